@@ -0,0 +1,347 @@
+from PySide6.QtCore import QThread, Signal
+from urllib.parse import urlsplit
+import os
+import json
+import base64
+import socket
+import struct
+import threading
+import requests
+from .config import cfg
+from .data import ARIA2_RPC_URL, ARIA2_RPC_SECRET
+from .job import FINAL_STATUSES
+from .progress import DownloadProgress
+from .session import get_session, get_timeout
+
+POLL_INTERVAL = 1  # tellStatus 轮询间隔(秒)
+POLL_MAX_INTERVAL = 30  # 连续轮询失败时的最长间隔(秒)
+STATUS_KEYS = ["gid", "status", "totalLength", "completedLength", "downloadSpeed", "errorMessage"]
+NOTIFICATIONS = ("aria2.onDownloadComplete", "aria2.onDownloadError", "aria2.onDownloadStop", "aria2.onDownloadPause")
+
+
+class Aria2Error(Exception):
+    pass
+
+
+def build_options(directory, filename, sha256=None, rate_limit=None):
+    """aria2.addUri 的选项: 分段下载参数取自设置, 有 sha256 时交给 aria2 校验; rate_limit 为任务单独的限速(MB/s)"""
+    options = {
+        "dir": directory,
+        "out": filename,
+        "split": str(cfg.get(cfg.aria2_split)),
+        "max-connection-per-server": str(cfg.get(cfg.aria2_max_connection_per_server)),
+        "min-split-size": f"{cfg.get(cfg.aria2_min_split_size)}M",
+        "file-allocation": cfg.get(cfg.aria2_file_allocation),
+        # 已安装的模型在提交前就被跳过, 仍提交的同名文件是需要重新下载的
+        "allow-overwrite": "true",
+        # 重试和停滞检测沿用直接下载的设置, 由 aria2 自己执行
+        "max-tries": str(cfg.get(cfg.retry_attempts) + 1),
+        "lowest-speed-limit": f"{cfg.get(cfg.stall_speed)}K",
+        "max-download-limit": rate_limit_option(rate_limit),
+    }
+    if sha256:
+        options["checksum"] = f"sha-256={sha256}"
+    return options
+
+
+def rate_limit_option(rate_limit=None):
+    return f"{cfg.get(cfg.file_rate_limit) if rate_limit is None else rate_limit}M"
+
+
+def global_options():
+    """aria2.changeGlobalOption 的选项: 设置中的总限速作用于 aria2 的所有任务"""
+    return {"max-overall-download-limit": f"{cfg.get(cfg.rate_limit)}M"}
+
+
+class Aria2Client:
+    """Aria2 JSON-RPC 客户端, 通过共享的连接池发送请求"""
+
+    def __init__(self, rpc_url=ARIA2_RPC_URL, secret=ARIA2_RPC_SECRET):
+        self.rpc_url = rpc_url
+        self.secret = secret
+
+    def call(self, method, *params):
+        return self.request(method, [f"token:{self.secret}", *params])
+
+    def multicall(self, calls):
+        """用一次 system.multicall 执行多个 (method, params) 调用, 返回每个调用的结果或 Aria2Error"""
+        methods = [
+            {"methodName": method, "params": [f"token:{self.secret}", *params]} for method, params in calls
+        ]
+        results = self.request("system.multicall", [methods])
+        # 成功的调用结果包在单元素列表里, 失败的是 {"code": ..., "message": ...}
+        return [
+            Aria2Error(result.get("message", str(result))) if isinstance(result, dict) else result[0]
+            for result in results
+        ]
+
+    def request(self, method, params):
+        payload = {"jsonrpc": "2.0", "method": method, "id": 1, "params": params}
+        try:
+            response = get_session().post(self.rpc_url, data=json.dumps(payload), timeout=get_timeout())
+        except requests.exceptions.RequestException as e:
+            raise Aria2Error(f"Failed to connect to Aria2 RPC: {e}") from e
+
+        try:
+            data = response.json()
+        except ValueError:
+            raise Aria2Error(f"HTTP {response.status_code}: {response.text}")
+        if "error" in data:
+            raise Aria2Error(data["error"].get("message", str(data["error"])))
+        return data["result"]
+
+    def add_uris(self, tasks):
+        """tasks: [(url, options)], 返回每个任务的 GID 或 Aria2Error; 同一次调用里先设置总限速"""
+        calls = [("aria2.changeGlobalOption", [global_options()])]
+        calls += [("aria2.addUri", [[url], options]) for url, options in tasks]
+        return self.multicall(calls)[1:]
+
+
+class Aria2SubmitThread(QThread):
+    """在后台线程中一次性把所有任务提交给 Aria2"""
+    submitted = Signal(list)  # [(url, gid 或 None, 错误信息 或 None)]
+    failed = Signal(str)
+
+    def __init__(self, tasks, client=None):
+        super().__init__()
+        self.tasks = tasks
+        self.client = client or Aria2Client()
+
+    def run(self):
+        try:
+            results = self.client.add_uris(self.tasks)
+        except Aria2Error as e:
+            self.failed.emit(str(e))
+            return
+
+        self.submitted.emit([
+            (url, None, str(result)) if isinstance(result, Aria2Error) else (url, result, None)
+            for (url, _), result in zip(self.tasks, results)
+        ])
+
+
+class Aria2CallThread(QThread):
+    """在后台线程中用一次 system.multicall 执行暂停、继续、删除等调用"""
+    done = Signal(list)  # 每个调用的结果或 Aria2Error
+    failed = Signal(str)
+
+    def __init__(self, calls, client=None):
+        super().__init__()
+        self.calls = calls
+        self.client = client or Aria2Client()
+
+    def run(self):
+        try:
+            results = self.client.multicall(self.calls)
+        except Aria2Error as e:
+            self.failed.emit(str(e))
+            return
+        self.done.emit(results)
+
+
+class Aria2Notifications:
+    """接收 aria2 WebSocket 通知的最小客户端, 只处理服务器推送的文本帧"""
+
+    def __init__(self, rpc_url=ARIA2_RPC_URL):
+        url = urlsplit(rpc_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.path = url.path or "/jsonrpc"
+        self.sock = None
+        self.buffer = b""
+        self.message = b""  # 分片消息中已收到的部分
+
+    def connect(self, timeout=POLL_INTERVAL):
+        self.sock = socket.create_connection((self.host, self.port), timeout=timeout)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall((
+            f"GET {self.path} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n\r\n"
+        ).encode())
+        while b"\r\n\r\n" not in self.buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionError("WebSocket handshake failed")
+            self.buffer += data
+        headers, self.buffer = self.buffer.split(b"\r\n\r\n", 1)
+        if b" 101 " not in headers.split(b"\r\n", 1)[0]:
+            raise ConnectionError("WebSocket handshake rejected")
+
+    def receive(self):
+        """返回一条通知(dict), 连接关闭时返回 None; 超时抛出 socket.timeout, 已收到的部分留到下次继续"""
+        while True:
+            first, payload = self.read_frame()
+            opcode = first & 0x0f
+            if opcode == 0x8:
+                return None
+            if opcode == 0x9:
+                self.send(0xa, payload)
+                continue
+            if opcode in (0x0, 0x1, 0x2):
+                self.message += payload
+                if first & 0x80:
+                    message, self.message = self.message, b""
+                    return json.loads(message)
+
+    def read_frame(self):
+        """返回一个完整的帧 (第一个字节, 去掉掩码的负载); 整帧到齐前帧头也留在缓冲区里"""
+        while True:
+            frame = self.parse_frame()
+            if frame is not None:
+                return frame
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError("WebSocket connection closed")
+            self.buffer += data
+
+    def parse_frame(self):
+        buffer = self.buffer
+        if len(buffer) < 2:
+            return None
+        first, second = buffer[0], buffer[1]
+        length = second & 0x7f
+        offset = 2
+        if length == 126:
+            if len(buffer) < 4:
+                return None
+            length = struct.unpack("!H", buffer[2:4])[0]
+            offset = 4
+        elif length == 127:
+            if len(buffer) < 10:
+                return None
+            length = struct.unpack("!Q", buffer[2:10])[0]
+            offset = 10
+        mask = None
+        if second & 0x80:
+            mask = buffer[offset:offset + 4]
+            offset += 4
+        if len(buffer) < offset + length:
+            return None
+        payload = buffer[offset:offset + length]
+        self.buffer = buffer[offset + length:]
+        if mask:
+            payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        return first, payload
+
+    def send(self, opcode, payload):
+        # 客户端发出的帧必须加掩码
+        mask = os.urandom(4)
+        header = bytes([0x80 | opcode, 0x80 | len(payload)])
+        self.sock.sendall(header + mask + bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload)))
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class Aria2Monitor(QThread):
+    """跟踪已提交给 Aria2 的任务: 订阅 WebSocket 通知, 并只对这些 GID 批量轮询 tellStatus"""
+    update_progress = Signal(object)  # DownloadProgress, 与直接下载使用同一种进度对象
+    status_changed = Signal(str, str)  # GID, 新的状态
+    download_complete = Signal(str)  # GID
+    download_error = Signal(str, str)  # GID, 错误信息
+    failed = Signal(str)
+
+    def __init__(self, gids, client=None):
+        super().__init__()
+        self.gids = list(gids)
+        self.client = client or Aria2Client()
+        self.statuses = {}
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        listener = threading.Thread(target=self.listen, daemon=True)
+        listener.start()
+        errors = 0
+        try:
+            while not self.stopped.is_set():
+                try:
+                    self.poll()
+                except Aria2Error as e:
+                    # aria2 重启或单次请求超时后仍继续跟踪, 连续出错只报告第一次, 轮询间隔逐渐加长
+                    if not errors:
+                        self.failed.emit(str(e))
+                    errors += 1
+                    self.stopped.wait(min(POLL_MAX_INTERVAL, POLL_INTERVAL * 2 ** errors))
+                    continue
+                errors = 0
+                self.update_progress.emit(self.snapshot())
+                if self.is_done():
+                    return
+                # 收到通知时提前醒来, 否则按间隔轮询
+                self.wakeup.wait(POLL_INTERVAL)
+                self.wakeup.clear()
+        finally:
+            self.stopped.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+    def is_done(self):
+        return all(self.statuses.get(gid, {}).get("status") in FINAL_STATUSES for gid in self.gids)
+
+    def poll(self):
+        pending = [gid for gid in self.gids if self.statuses.get(gid, {}).get("status") not in FINAL_STATUSES]
+        if not pending:
+            return
+        results = self.client.multicall([("aria2.tellStatus", [gid, STATUS_KEYS]) for gid in pending])
+        for gid, result in zip(pending, results):
+            if isinstance(result, Aria2Error):
+                # aria2 已不再记录这个任务
+                result = {"gid": gid, "status": "removed", "errorMessage": str(result)}
+            previous = self.statuses.get(gid, {}).get("status")
+            self.statuses[gid] = result
+            if result["status"] != previous:
+                self.status_changed.emit(gid, result["status"])
+                if result["status"] == "complete":
+                    self.download_complete.emit(gid)
+                elif result["status"] == "error":
+                    self.download_error.emit(gid, result.get("errorMessage", ""))
+
+    def listen(self):
+        notifications = Aria2Notifications(self.client.rpc_url)
+        try:
+            notifications.connect()
+            while not self.stopped.is_set():
+                try:
+                    message = notifications.receive()
+                except socket.timeout:
+                    continue
+                if message is None:
+                    return
+                if message.get("method") in NOTIFICATIONS:
+                    gids = [event.get("gid") for event in message.get("params", [])]
+                    if any(gid in self.gids for gid in gids):
+                        self.wakeup.set()
+        except (OSError, ValueError):
+            # 没有 WebSocket 或收到无法解析的消息时只靠轮询
+            return
+        finally:
+            notifications.close()
+
+    def snapshot(self):
+        statuses = [self.statuses.get(gid, {}) for gid in self.gids]
+        active = [status for status in statuses if status.get("status") not in FINAL_STATUSES]
+        return DownloadProgress(
+            active=len(active),
+            downloaded=self.total(active, "completedLength"),
+            total_size=self.total(active, "totalLength"),
+            finished=len(statuses) - len(active),
+            total_files=len(statuses),
+            batch_downloaded=self.total(statuses, "completedLength"),
+            batch_size=self.total(statuses, "totalLength"),
+            speed=self.total(active, "downloadSpeed"),
+            files={gid: int(status.get("completedLength", 0)) for gid, status in zip(self.gids, statuses)},
+        )
+
+    @staticmethod
+    def total(statuses, key):
+        # aria2 的数值字段都是字符串
+        return sum(int(status.get(key, 0)) for status in statuses)
@@ -0,0 +1,368 @@
+from PySide6.QtCore import QThread, Signal
+from concurrent.futures import ThreadPoolExecutor
+import os
+import asyncio
+import threading
+import aiohttp
+from .config import cfg
+from .data import models_info
+from .installed import fingerprints
+from .download_thread import DownloadThread, BUFFER_SIZE, split_segments
+from .job import PAUSED, REMOVED
+from .mirrors import MirrorRace, mirror_selector
+from .part_file import PartFile
+from .progress import ProgressReporter
+from .rate_limit import rate_limiter
+from .redirects import STALE_STATUS, redirect_cache
+from .retry import DownloadStalled, StallDetector, backoff_delay, is_retryable, retry_metrics
+from .session import get_timeout
+
+WRITER_THREADS = 4  # 负责磁盘写入和 sha256 的线程数, 网络读取都在事件循环里
+# 不含其他 OSError: 写入线程池里的磁盘错误(磁盘已满、只读等)直接报告, 不当作镜像出错去换镜像重试
+NETWORK_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError, TimeoutError)
+
+
+class AsyncDownloadThread(QThread):
+    """在 QThread 自己的 asyncio 事件循环里下载, 所有文件和分段共用少量线程
+
+    信号与 DownloadThread 相同, DirectBackend 可以直接替换使用。
+    """
+    update_progress = Signal(object)
+    download_started = Signal(str)
+    download_complete = Signal(str)
+    download_error = Signal(str, str)
+    download_stopped = Signal(str, str)
+
+    def __init__(self, urls, target_dir, preflight=None):
+        super().__init__()
+        self.urls = urls
+        self.target_dir = target_dir
+        self.preflight = preflight or {}  # url -> PreflightResult
+        self.segments = cfg.get(cfg.download_segments)
+        self.max_workers = cfg.get(cfg.concurrent_files)
+        self.progress = ProgressReporter(
+            self.update_progress.emit, {url: DownloadThread.expected_size(url, self.preflight) for url in urls}
+        )
+        self.loop = None
+        self.tasks = {}  # url -> 下载该文件的 asyncio.Task, 继续下载时换成新的任务
+        self.started = []  # (url, asyncio.Task), 按开始顺序; enqueue 追加的也在其中
+        self.enqueued = len(urls)  # 已安排开始的文件数, 与 started 相等时没有待开始的文件
+        self.closed = False  # 已收齐所有结果, 不再接受 enqueue
+        self.lock = threading.Lock()
+        self.files = None
+        self.stop_requests = {}  # url -> paused 或 removed
+        self.session = None
+        self.writer = None
+
+    def run(self):
+        asyncio.run(self.main())
+
+    def stop(self, urls=None, status=PAUSED):
+        """暂停或取消指定的文件, 默认整批; 可在任意线程调用, 下载任务在下一个 await 处被取消"""
+        urls = urls or self.urls
+        for url in urls:
+            self.stop_requests[url] = status
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.cancel_tasks, urls)
+
+    def cancel_tasks(self, urls):
+        for url in urls:
+            if url in self.tasks:
+                self.tasks[url].cancel()
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        publisher = asyncio.create_task(self.progress.run_async())
+        self.writer = ThreadPoolExecutor(max_workers=WRITER_THREADS)
+        connect_timeout, read_timeout = get_timeout()
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=cfg.get(cfg.max_connections_per_host))
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout, auto_decompress=False) as session:
+                self.session = session
+                if self.urls and cfg.get(cfg.auto_select_mirror):
+                    # 测速仍用 requests, 放到默认线程池里
+                    await self.loop.run_in_executor(None, mirror_selector.probe, self.urls[0])
+
+                self.files = asyncio.Semaphore(self.max_workers)
+                for url in list(self.urls):
+                    self.start_task(url)
+                await self.collect()
+        finally:
+            with self.lock:
+                self.closed = True
+            publisher.cancel()
+            self.writer.shutdown(wait=True)
+            self.progress.stop()
+
+    def start_task(self, url):
+        task = asyncio.ensure_future(self.download_model(url, self.files))
+        self.tasks[url] = task
+        self.started.append((url, task))
+
+    async def collect(self):
+        # 按开始顺序等待每个文件, enqueue 追加的文件也等到结束
+        index = 0
+        while True:
+            if index < len(self.started):
+                url, task = self.started[index]
+                index += 1
+                await asyncio.wait([task])
+                if not task.cancelled() and task.exception() is not None:
+                    error = task.exception()
+                    self.download_error.emit(url, str(error) or type(error).__name__)
+                continue
+            with self.lock:
+                if self.enqueued == len(self.started):
+                    self.closed = True
+                    return
+            # enqueue 安排的 start_task 还没在事件循环里执行
+            await asyncio.sleep(0)
+
+    def enqueue(self, url, preflight=None):
+        """与 DownloadThread.enqueue 相同: 把继续下载的文件加入这批, 这批已在收尾时返回 False"""
+        with self.lock:
+            if self.closed or self.files is None:
+                return False
+            self.stop_requests.pop(url, None)
+            if preflight is not None:
+                self.preflight[url] = preflight
+            if url not in self.urls:
+                self.urls.append(url)
+            self.enqueued += 1
+            self.loop.call_soon_threadsafe(self.start_task, url)
+        return True
+
+    async def in_writer(self, func, *args):
+        return await self.loop.run_in_executor(self.writer, func, *args)
+
+    async def download_model(self, url, files):
+        model_filename = url.split("/")[-1]
+        category = url.split("/")[-2]
+        os.makedirs(os.path.join(self.target_dir, category), exist_ok=True)
+        file_path = os.path.join(self.target_dir, category, model_filename)
+        status = self.stop_requests.get(url)
+        if status is None:
+            try:
+                async with files:
+                    await self.download_file(url, file_path)
+                return
+            except asyncio.CancelledError:
+                status = self.stop_requests.get(url)
+                if status is None:
+                    raise
+
+        # 暂停时分段进度已在 download_segmented 中保存, 继续下载时从 .part 续传; 取消时删除 .part
+        if status == REMOVED:
+            await self.in_writer(PartFile(file_path, 0).discard)
+        self.download_stopped.emit(url, status)
+
+    async def download_file(self, url, file_path):
+        model_filename = os.path.basename(file_path)
+        result = self.preflight.get(url)
+        if result is not None and result.ranged:
+            total_size, accept_ranges = result.size, True
+        else:
+            total_size, accept_ranges = await self.retry(url, lambda: self.probe(url))
+        etag = result.etag if result is not None else None
+        part = PartFile(file_path, total_size, models_info.get(model_filename, {}).get("sha256"), etag)
+
+        if accept_ranges and total_size:
+            if await self.in_writer(part.load):
+                await self.in_writer(part.catch_up)
+            else:
+                await self.in_writer(part.create, split_segments(total_size, self.segments))
+        else:
+            await self.in_writer(part.discard)
+
+        self.progress.begin(url, part.downloaded, total_size)
+        self.download_started.emit(url)
+        finished = False
+        try:
+            if part.segments:
+                await self.download_segmented(url, part)
+            else:
+                await self.download_stream(url, part)
+
+            digest = await self.in_writer(part.hexdigest)
+            if part.sha256 and digest != part.sha256:
+                await self.in_writer(part.discard)
+                self.download_error.emit(url, f"sha256 mismatch (expected {part.sha256}, got {digest}), the file has been discarded")
+            else:
+                await self.in_writer(part.promote)
+                await self.in_writer(fingerprints.record, file_path, digest)
+                self.download_complete.emit(url)
+            finished = True
+        finally:
+            self.progress.end(url, finished)
+            rate_limiter.release(url)
+
+    async def probe(self, url):
+        """用 Range: bytes=0-0 探测文件大小和服务器是否支持分段"""
+        response = await self.request(url, {"Range": "bytes=0-0"})
+        async with response:
+            content_range = response.headers.get('Content-Range', '')
+            if response.status == 206 and '/' in content_range:
+                await response.read()
+                total_size = content_range.rsplit('/', 1)[-1]
+                if total_size.isdigit():
+                    return int(total_size), True
+            return int(response.headers.get('Content-Length', 0)), False
+
+    async def retry(self, url, attempt):
+        """与 DownloadThread.retry 相同, attempt 返回协程; 等待期间暂停或取消会直接取消任务"""
+        attempts = cfg.get(cfg.retry_attempts)
+        for i in range(attempts + 1):
+            try:
+                return await attempt()
+            except NETWORK_ERRORS as e:
+                if i == attempts or not is_retryable(e):
+                    raise
+                retry_metrics.record(e)
+                self.progress.retry()
+                await asyncio.sleep(backoff_delay(i, e))
+
+    async def get(self, request_url, headers):
+        """与 DownloadThread.get 相同, 经过重定向缓存请求 request_url"""
+        cached = redirect_cache.get(request_url)
+        response = await self.session.get(cached or request_url, headers=headers)
+        if cached and response.status in STALE_STATUS:
+            response.release()
+            redirect_cache.invalidate(request_url)
+            response = await self.session.get(request_url, headers=headers)
+        if response.history:
+            redirect_cache.store(request_url, str(response.url))
+        return response
+
+    async def request(self, url, headers):
+        """按镜像排名依次尝试, 返回第一个成功的响应"""
+        for candidate in mirror_selector.candidates(url):
+            try:
+                response = await self.get(candidate, headers)
+                if response.status >= 400:
+                    response.release()
+                    response.raise_for_status()
+                return response
+            except NETWORK_ERRORS as e:
+                mirror_selector.report_failure(candidate)
+                error = e
+        raise error
+
+    async def download_stream(self, url, part):
+        await self.retry(url, lambda: self.fetch_stream(url, part))
+
+    async def fetch_stream(self, url, part):
+        part.restart()
+        self.progress.begin(url, 0, part.size)
+        response = await self.request(url, {"Accept-Encoding": "identity"})
+        async with response:
+            if not part.size:
+                self.progress.set_total(url, int(response.headers.get('Content-Length', 0)))
+            f = await self.in_writer(open, part.path, 'wb', 0)
+            try:
+                await self.copy_response(url, part, response, f, 0)
+            finally:
+                await self.in_writer(f.close)
+
+    async def download_segmented(self, url, part):
+        if part.size >= cfg.get(cfg.mirror_race_min_size) * 1024 * 1024:
+            race = mirror_selector.race(url)
+        else:
+            race = MirrorRace([None])
+        count = max(1, min(self.segments, len(part.pending)))
+        workers = [asyncio.ensure_future(self.segment_worker(url, part, race)) for _ in range(count)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            # 出错或被取消时, 等所有分段连同未完成的写入都退出后再保存进度
+            for worker in workers:
+                worker.cancel()
+            await asyncio.wait(workers)
+            await self.in_writer(part.save, True)
+
+    async def segment_worker(self, url, part, race):
+        while True:
+            preferred = race.choose()
+            segment = part.claim(lambda victim: race.share(preferred, victim))
+            if segment is None:
+                return
+            race.begin(preferred, segment)
+            try:
+                await self.download_segment(url, part, segment, preferred)
+            finally:
+                race.end(segment)
+
+    async def download_segment(self, url, part, segment, preferred=None):
+        await self.retry(url, lambda: self.fetch_segment_from_mirrors(url, part, segment, preferred))
+        await self.in_writer(part.catch_up)
+
+    async def fetch_segment_from_mirrors(self, url, part, segment, preferred):
+        for candidate in mirror_selector.candidates(url, preferred):
+            try:
+                await self.fetch_segment(candidate, url, part, segment)
+                return
+            except NETWORK_ERRORS as e:
+                mirror_selector.report_failure(candidate)
+                error = e
+        raise error
+
+    async def fetch_segment(self, request_url, url, part, segment):
+        start, end, done = segment
+        if start + done > end:
+            return
+
+        headers = {"Range": f"bytes={start + done}-{end}", "Accept-Encoding": "identity"}
+        async with await self.get(request_url, headers) as response:
+            if response.status != 206:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history, status=response.status,
+                    message=f"Server ignored Range request for {request_url}"
+                )
+            f = await self.in_writer(open, part.path, 'r+b', 0)
+            try:
+                await self.in_writer(f.seek, start + done)
+                await self.copy_response(url, part, response, f, start + done, segment)
+            finally:
+                await self.in_writer(f.close)
+
+    async def copy_response(self, url, part, response, f, offset, segment=None):
+        """读取与写入重叠进行, 但同一时刻最多只有一次写入未完成: 磁盘跟不上时暂停读取, 由 TCP 流控限制对端"""
+        pending = None
+        stall = StallDetector(cfg.get(cfg.stall_speed) * 1024, cfg.get(cfg.stall_timeout))
+        try:
+            while True:
+                size = BUFFER_SIZE
+                if segment is not None:
+                    remaining = segment[1] - offset + 1
+                    if remaining <= 0:
+                        break
+                    size = min(size, remaining)
+                chunk = await response.content.read(size)
+                if not chunk:
+                    break
+                # read 有数据就返回, 慢速连接在这里就能发现
+                stall.feed(len(chunk))
+                if stall.check():
+                    raise DownloadStalled(stall.message)
+                if pending is not None:
+                    # shield: 任务被取消时写入照常完成, 由下面的 finally 等待
+                    await asyncio.shield(pending)
+                pending = self.loop.run_in_executor(self.writer, self.write_chunk, url, part, f, offset, chunk, segment)
+                offset += len(chunk)
+                delay = rate_limiter.consume(url, len(chunk))
+                if delay:
+                    stall.exclude(delay)
+                    await asyncio.sleep(delay)
+        finally:
+            # 关闭文件或保存进度前, 正在进行的写入必须已经完成
+            if pending is not None:
+                await pending
+
+    def write_chunk(self, url, part, f, offset, chunk, segment):
+        # 在写入线程中执行, 与 DownloadThread.copy_response 的写入步骤相同
+        f.write(chunk)
+        part.feed(offset, chunk)
+        self.progress.add(url, len(chunk))
+        if segment is not None:
+            segment[2] += len(chunk)
+            part.save()
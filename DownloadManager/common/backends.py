@@ -0,0 +1,359 @@
+from PySide6.QtCore import QObject, Signal
+import os
+from .config import cfg
+from .aria2 import (
+    Aria2Client, Aria2SubmitThread, Aria2CallThread, Aria2Monitor, build_options, global_options, rate_limit_option
+)
+from .download_thread import DownloadThread
+from .installed import fingerprints
+from .part_file import PartFile
+from .policy import order_jobs
+from .rate_limit import rate_limiter
+from .job import WAITING, ACTIVE, PAUSED, COMPLETE, ERROR, REMOVED
+
+
+class DownloadBackend(QObject):
+    """下载后端的公共接口: 提交、暂停、继续、取消任务, 通过信号报告进度和任务状态"""
+    name = ""
+    submitted = Signal(list)  # 本次接受的 DownloadJob, 提交失败的任务状态为 error
+    job_changed = Signal(object)  # 状态变化的 DownloadJob
+    update_progress = Signal(object)  # DownloadProgress
+    failed = Signal(str)  # 后端本身出错, 例如连不上 Aria2
+    finished = Signal()  # 已提交的任务全部结束
+
+    def __init__(self, target_dir):
+        super().__init__()
+        self.target_dir = target_dir
+        self.jobs = []
+
+    def submit(self, jobs):
+        raise NotImplementedError
+
+    def pause(self, jobs=None):
+        raise NotImplementedError(f"{self.name} backend does not support pause")
+
+    def resume(self, jobs=None):
+        raise NotImplementedError(f"{self.name} backend does not support resume")
+
+    def cancel(self, jobs=None):
+        raise NotImplementedError(f"{self.name} backend does not support cancel")
+
+    def set_rate_limit(self, jobs, rate):
+        """单独设置 jobs 的限速(MB/s), None 时恢复为设置中的单文件限速"""
+        raise NotImplementedError(f"{self.name} backend does not support per-job rate limits")
+
+    def restore(self, jobs):
+        """恢复上次运行时未完成的任务"""
+        raise NotImplementedError
+
+    def status(self):
+        return list(self.jobs)
+
+    def is_busy(self):
+        return any(not job.is_final for job in self.jobs)
+
+    def set_status(self, job, status, error=None):
+        if job.status == status and job.error == error:
+            return
+        job.status = status
+        job.error = error
+        self.job_changed.emit(job)
+
+
+class DirectBackend(DownloadBackend):
+    """用 DownloadThread 或 AsyncDownloadThread 直接下载, 下载过程中提交的任务排在当前这批之后"""
+    name = "direct"
+
+    def __init__(self, target_dir):
+        super().__init__(target_dir)
+        self.queue = []
+        self.thread = None
+        self.running = {}  # url -> 正在由 thread 下载的 DownloadJob
+
+    def submit(self, jobs):
+        for job in jobs:
+            job.backend = self.name
+        self.jobs.extend(jobs)
+        self.queue.extend(jobs)
+        self.submitted.emit(jobs)
+        if self.thread is None:
+            self.start_next()
+
+    def start_next(self):
+        if not self.queue:
+            self.thread = None
+            self.finished.emit()
+            return
+        # 下载过程中追加或继续的任务与原有的一起按调度策略重新排序
+        jobs, self.queue = order_jobs(self.queue, cfg.get(cfg.scheduling_policy)), []
+        self.running = {job.url: job for job in jobs}
+        self.thread = self.create_thread(jobs)
+        self.thread.update_progress.connect(self.thread_progress)
+        self.thread.download_started.connect(self.download_started)
+        self.thread.download_complete.connect(self.download_complete)
+        self.thread.download_error.connect(self.download_error)
+        self.thread.download_stopped.connect(self.download_stopped)
+        self.thread.finished.connect(self.thread_finished)
+        self.thread.start()
+
+    def restore(self, jobs):
+        # 暂停的任务保持暂停, 其余的重新排队, 下载时从 .part 续传
+        paused = [job for job in jobs if job.status == PAUSED]
+        for job in paused:
+            job.backend = self.name
+        self.jobs.extend(paused)
+        waiting = [job for job in jobs if job.status != PAUSED]
+        for job in waiting:
+            job.status = WAITING
+        if waiting:
+            self.submit(waiting)
+
+    def create_thread(self, jobs):
+        urls = [job.url for job in jobs]
+        # 预检已知大小和 Range 支持的文件, 下载线程直接按它规划分段
+        preflight = {job.url: job.preflight for job in jobs if job.preflight is not None}
+        for job in jobs:
+            if job.rate_limit is not None:
+                rate_limiter.set_limit(job.url, job.rate_limit)
+        if cfg.get(cfg.download_engine) == "asyncio":
+            try:
+                # aiohttp 是可选依赖, 只有选用 asyncio 引擎时才需要
+                from .async_engine import AsyncDownloadThread
+                return AsyncDownloadThread(urls, self.target_dir, preflight)
+            except ImportError as e:
+                self.failed.emit(f"asyncio engine unavailable ({e}), using the threaded engine")
+        return DownloadThread(urls, self.target_dir, preflight)
+
+    def thread_progress(self, progress):
+        for url, downloaded in progress.files.items():
+            if url in self.running:
+                self.running[url].downloaded = downloaded
+        self.update_progress.emit(progress)
+
+    def download_started(self, url):
+        self.set_status(self.running[url], ACTIVE)
+
+    def download_complete(self, url):
+        self.set_status(self.running[url], COMPLETE)
+
+    def download_error(self, url, message):
+        self.set_status(self.running[url], ERROR, message)
+
+    def download_stopped(self, url, status):
+        # 停下的文件不再属于这个线程, 继续下载时重新排队
+        self.set_status(self.running.pop(url), status)
+
+    def thread_finished(self):
+        if self.sender() is not self.thread:
+            return
+        for job in self.running.values():
+            if not job.is_final and job.status != PAUSED:
+                self.set_status(job, ERROR, "download stopped unexpectedly")
+        self.running = {}
+        self.start_next()
+
+    def pause(self, jobs=None):
+        self.stop_jobs(jobs, PAUSED)
+
+    def cancel(self, jobs=None):
+        self.stop_jobs(jobs, REMOVED)
+
+    def set_rate_limit(self, jobs, rate):
+        for job in jobs:
+            job.rate_limit = rate
+            # 排队中的任务在 create_thread 时设置
+            if self.running.get(job.url) is job:
+                rate_limiter.set_limit(job.url, rate)
+
+    def resume(self, jobs=None):
+        # 暂停的文件交给正在运行的线程, 有空闲的下载线程时立即开始; 线程已在收尾时重新排队。
+        # 下载时从 .part 记录的进度续传
+        jobs = [job for job in (jobs or self.jobs) if job.status == PAUSED]
+        for job in jobs:
+            self.set_status(job, WAITING)
+            if self.thread is not None and self.thread.enqueue(job.url, job.preflight):
+                if job.rate_limit is not None:
+                    rate_limiter.set_limit(job.url, job.rate_limit)
+                self.running[job.url] = job
+            else:
+                self.queue.append(job)
+        if self.queue and self.thread is None:
+            self.start_next()
+
+    def stop_jobs(self, jobs, status):
+        jobs = [job for job in (jobs or self.jobs) if not job.is_final]
+        # 正在下载或已交给下载线程的文件, 由线程在两次读取之间停下
+        running = [job.url for job in jobs if self.running.get(job.url) is job and job.status != PAUSED]
+        if running:
+            self.thread.stop(running, status)
+        for job in jobs:
+            if job.url in running:
+                continue
+            if job in self.queue:
+                self.queue.remove(job)
+            if status == REMOVED:
+                # 暂停或排队中的文件可能留有上次的 .part
+                PartFile(os.path.join(self.target_dir, job.category, job.filename), 0).discard()
+            self.set_status(job, status)
+
+
+class Aria2Backend(DownloadBackend):
+    """把任务交给 Aria2 下载, 用 Aria2Monitor 跟踪提交的 GID"""
+    name = "aria2"
+
+    def __init__(self, target_dir, client=None):
+        super().__init__(target_dir)
+        self.client = client or Aria2Client()
+        self.by_gid = {}
+        self.threads = []  # 正在运行的提交和控制线程, 保留引用直到结束
+        self.monitor = None
+        # 设置中的限速修改后同步给已提交的任务
+        cfg.rate_limit.valueChanged.connect(self.total_limit_changed)
+        cfg.file_rate_limit.valueChanged.connect(self.file_limit_changed)
+
+    def submit(self, jobs):
+        for job in jobs:
+            job.backend = self.name
+        self.jobs.extend(jobs)
+        tasks = [
+            (job.url, build_options(os.path.join(self.target_dir, job.category), job.filename, job.sha256, job.rate_limit))
+            for job in jobs
+        ]
+        # 所有任务合并成一次 system.multicall, 在后台线程提交, 不阻塞界面
+        thread = Aria2SubmitThread(tasks, self.client)
+        thread.jobs = jobs
+        thread.submitted.connect(self.aria2_submitted)
+        thread.failed.connect(self.submit_failed)
+        self.start_thread(thread)
+
+    def restore(self, jobs):
+        # 带 GID 的任务仍由 Aria2 负责, 重新跟踪即可; 没来得及提交的任务重新提交
+        submitted = [job for job in jobs if job.gid]
+        for job in submitted:
+            job.backend = self.name
+            self.by_gid[job.gid] = job
+        self.jobs.extend(submitted)
+        self.monitor_jobs([job.gid for job in submitted])
+        unsubmitted = [job for job in jobs if not job.gid]
+        if unsubmitted:
+            self.submit(unsubmitted)
+
+    def aria2_submitted(self, results):
+        jobs = self.sender().jobs
+        for job, (_, gid, error) in zip(jobs, results):
+            # 提交结果通过 submitted 一起报告, 这里不逐个发出 job_changed
+            if gid:
+                job.gid = gid
+                self.by_gid[gid] = job
+            else:
+                job.status, job.error = ERROR, error
+        self.submitted.emit(jobs)
+        self.monitor_jobs([job.gid for job in jobs if job.gid])
+
+    def submit_failed(self, message):
+        jobs = self.sender().jobs
+        for job in jobs:
+            job.status, job.error = ERROR, message
+        self.failed.emit(message)
+
+    def monitor_jobs(self, gids):
+        if not gids:
+            return
+        if self.monitor is not None and self.monitor.isRunning():
+            # 新提交的任务并入正在跟踪的任务
+            gids = self.monitor.gids + gids
+            self.monitor.stop()
+            self.monitor.wait()
+
+        self.monitor = Aria2Monitor(gids, self.client)
+        self.monitor.update_progress.connect(self.monitor_progress)
+        self.monitor.status_changed.connect(self.aria2_status_changed)
+        self.monitor.download_error.connect(self.aria2_download_error)
+        self.monitor.failed.connect(self.failed)
+        self.monitor.finished.connect(self.monitor_finished)
+        self.monitor.start()
+
+    def monitor_progress(self, progress):
+        for gid, downloaded in progress.files.items():
+            if gid in self.by_gid:
+                self.by_gid[gid].downloaded = downloaded
+        self.update_progress.emit(progress)
+
+    def aria2_status_changed(self, gid, status):
+        job = self.by_gid.get(gid)
+        if job is None or status == ERROR:
+            return
+        if status == COMPLETE and job.sha256:
+            # aria2 已按 checksum 选项校验过文件
+            file_path = os.path.join(self.target_dir, job.category, job.filename)
+            if os.path.exists(file_path):
+                fingerprints.record(file_path, job.sha256)
+        # aria2 的 waiting 表示排队中, 与任务刚提交时相同
+        self.set_status(job, status if status in (ACTIVE, PAUSED, COMPLETE, REMOVED) else WAITING)
+
+    def aria2_download_error(self, gid, message):
+        if gid in self.by_gid:
+            self.set_status(self.by_gid[gid], ERROR, message)
+
+    def monitor_finished(self):
+        if self.sender() is self.monitor and self.monitor.is_done():
+            self.finished.emit()
+
+    def pause(self, jobs=None):
+        self.control("aria2.pause", jobs)
+
+    def resume(self, jobs=None):
+        self.control("aria2.unpause", jobs)
+
+    def cancel(self, jobs=None):
+        self.control("aria2.remove", jobs)
+
+    def set_rate_limit(self, jobs, rate):
+        for job in jobs:
+            job.rate_limit = rate
+        self.change_rate_limits(jobs)
+
+    def change_rate_limits(self, jobs):
+        # 已提交的任务用 aria2.changeOption 修改, 正在下载时立即生效
+        calls = [
+            ("aria2.changeOption", [job.gid, {"max-download-limit": rate_limit_option(job.rate_limit)}])
+            for job in jobs if job.gid and not job.is_final
+        ]
+        if calls:
+            thread = Aria2CallThread(calls, self.client)
+            thread.failed.connect(self.failed)
+            self.start_thread(thread)
+
+    def total_limit_changed(self):
+        # 没有未结束的任务时不必连接 aria2, 下次提交时一起设置
+        if not self.is_busy():
+            return
+        thread = Aria2CallThread([("aria2.changeGlobalOption", [global_options()])], self.client)
+        thread.failed.connect(self.failed)
+        self.start_thread(thread)
+
+    def file_limit_changed(self):
+        # 单独设置了限速的任务不受影响
+        self.change_rate_limits([job for job in self.jobs if job.rate_limit is None])
+
+    def control(self, method, jobs):
+        gids = [job.gid for job in (jobs or self.jobs) if job.gid and not job.is_final]
+        if not gids:
+            return
+        thread = Aria2CallThread([(method, [gid]) for gid in gids], self.client)
+        thread.failed.connect(self.failed)
+        # 状态变化由 Aria2Monitor 轮询得到
+        thread.done.connect(self.monitor_wakeup)
+        self.start_thread(thread)
+
+    def monitor_wakeup(self):
+        if self.monitor is not None:
+            self.monitor.wakeup.set()
+
+    def start_thread(self, thread):
+        self.threads.append(thread)
+        thread.finished.connect(self.thread_finished)
+        thread.start()
+
+    def thread_finished(self):
+        self.threads.remove(self.sender())
@@ -1,11 +1,36 @@
-from qfluentwidgets import QConfig, ConfigItem, qconfig, OptionsConfigItem, OptionsValidator
+from qfluentwidgets import (QConfig, ConfigItem, qconfig, OptionsConfigItem, OptionsValidator, RangeConfigItem, RangeValidator,
+                            BoolValidator)
 from .language import Language, LanguageSerializer
+from .policy import SCHEDULING_POLICIES
 
 class AppConfig(QConfig):
     
     aria2_port = ConfigItem("aria2", "Aria2_RPC_URL", 16800, restart=True)
     aria2_secret = ConfigItem("aria2", "Aria2_RPC_SECRET", "", restart=True)
+    aria2_split = RangeConfigItem("aria2", "Split", 8, RangeValidator(1, 64))
+    aria2_max_connection_per_server = RangeConfigItem("aria2", "MaxConnectionPerServer", 8, RangeValidator(1, 16))
+    aria2_min_split_size = RangeConfigItem("aria2", "MinSplitSize", 20, RangeValidator(1, 1024))  # MiB
+    aria2_file_allocation = OptionsConfigItem(
+        "aria2", "FileAllocation", "falloc", OptionsValidator(["none", "prealloc", "trunc", "falloc"])
+    )
     hf_endpoint = ConfigItem("huggingface", "HF_ENDPOINT", "https://hf-mirror.com", restart=True)
+    hf_endpoints = ConfigItem("huggingface", "HF_ENDPOINTS", ["https://hf-mirror.com", "https://huggingface.co"], restart=True)
+    auto_select_mirror = ConfigItem("huggingface", "AutoSelectMirror", True, BoolValidator())
+    download_engine = OptionsConfigItem("download", "Engine", "threaded", OptionsValidator(["threaded", "asyncio"]))
+    scheduling_policy = OptionsConfigItem("download", "SchedulingPolicy", "selection", OptionsValidator(SCHEDULING_POLICIES))
+    disk_space_policy = OptionsConfigItem("download", "DiskSpacePolicy", "trim", OptionsValidator(["trim", "reject"]))
+    download_segments = RangeConfigItem("download", "Segments", 4, RangeValidator(1, 16))
+    concurrent_files = RangeConfigItem("download", "ConcurrentFiles", 3, RangeValidator(1, 8))
+    mirror_race_min_size = RangeConfigItem("download", "MirrorRaceMinSize", 1024, RangeValidator(0, 8192))  # MiB
+    max_connections_per_host = RangeConfigItem("download", "MaxConnectionsPerHost", 16, RangeValidator(1, 64), restart=True)
+    connect_timeout = RangeConfigItem("download", "ConnectTimeout", 10, RangeValidator(1, 120))
+    read_timeout = RangeConfigItem("download", "ReadTimeout", 30, RangeValidator(1, 300))
+    rate_limit = RangeConfigItem("download", "RateLimit", 0, RangeValidator(0, 1000))  # MB/s, 0 为不限速
+    file_rate_limit = RangeConfigItem("download", "FileRateLimit", 0, RangeValidator(0, 1000))  # MB/s, 0 为不限速
+    fsync_policy = OptionsConfigItem("download", "FsyncPolicy", "end", OptionsValidator(["none", "end", "periodic"]))
+    retry_attempts = RangeConfigItem("download", "RetryAttempts", 5, RangeValidator(0, 20))
+    stall_speed = RangeConfigItem("download", "StallSpeed", 10, RangeValidator(0, 1024))  # KB/s, 0 为不检测
+    stall_timeout = RangeConfigItem("download", "StallTimeout", 30, RangeValidator(5, 300))  # 秒
     language = OptionsConfigItem(
         "MainWindow", "Language", Language.AUTO, OptionsValidator(Language), LanguageSerializer(), restart=True
         )
@@ -12,4 +12,6 @@ models_info = load_json('./data/models_info.json')
 port = cfg.get(cfg.aria2_port)
 ARIA2_RPC_URL = f"http://localhost:{port}/jsonrpc"
 ARIA2_RPC_SECRET = cfg.get(cfg.aria2_secret)
-HF_ENDPOINT = cfg.get(cfg.hf_endpoint)
\ No newline at end of file
+HF_ENDPOINT = cfg.get(cfg.hf_endpoint)
+# 候选镜像端点, 设置中的主端点排在最前
+HF_ENDPOINTS = [HF_ENDPOINT] + [endpoint for endpoint in cfg.get(cfg.hf_endpoints) if endpoint != HF_ENDPOINT]
\ No newline at end of file
@@ -0,0 +1,38 @@
+import os
+import json
+import shutil
+
+DISK_SPACE_RESERVE = 512 * 1024 * 1024  # 下载后至少保留的空闲空间
+
+
+def free_space(path):
+    """path 所在卷的空闲字节数, path 不存在时取最近的已存在的上级目录"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return shutil.disk_usage(path).free
+
+
+def partial_bytes(file_path):
+    """<file>.part 已经占用的字节数, 这部分空间不需要再申请"""
+    part_path = file_path + ".part"
+    if not os.path.exists(part_path):
+        return 0
+    stat = os.stat(part_path)
+    if hasattr(stat, "st_blocks"):
+        # 稀疏文件只算实际分配的块, 预分配过的文件算全部大小
+        return min(stat.st_blocks * 512, stat.st_size)
+    # Windows 没有 st_blocks, 用进度记录里已下载的字节数
+    try:
+        with open(file_path + ".part.json", 'r') as f:
+            return sum(done for _, _, done in json.load(f)["segments"])
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def required_space(job, target_dir):
+    file_path = os.path.join(target_dir, job.category, job.filename)
+    return max(0, job.size - partial_bytes(file_path))
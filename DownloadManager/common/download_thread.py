@@ -1,57 +1,404 @@
 from PySide6.QtCore import QThread, Signal
+from concurrent.futures import ThreadPoolExecutor
 import os
-from time import sleep
 import time
+import threading
+import http.client
 import requests
+import urllib3
+from .config import cfg
+from .data import models_info
+from .installed import fingerprints
+from .job import PAUSED, REMOVED
+from .mirrors import MirrorRace, mirror_selector
+from .part_file import PartFile
+from .progress import ProgressReporter
+from .rate_limit import rate_limiter
+from .redirects import STALE_STATUS, redirect_cache
+from .retry import DownloadStalled, StallDetector, backoff_delay, is_retryable, retry_metrics
+from .session import get_session, get_timeout
+
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024  # 每段最小 8 MiB, 小文件不分段
+BUFFER_SIZE = 1024 * 1024  # 每次 readinto 读取的最大字节数
+# readinto 直接读取底层响应, 网络错误不一定被 requests 包装
+NETWORK_ERRORS = (
+    requests.exceptions.RequestException, urllib3.exceptions.HTTPError, http.client.HTTPException,
+    ConnectionError, TimeoutError
+)
+
+
+class DownloadStopped(Exception):
+    """文件被暂停或取消, 在两次读取之间抛出"""
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+def readinto1(fp, view):
+    """像 http.client 的 read1 一样最多读一次 socket, 但读进已有的缓冲区
+
+    readinto 要读满缓冲区才返回, 慢速连接上一次读取可能超过停滞判定的时间窗口;
+    这里收到多少就返回多少, 停滞检测和进度都按实际到达的字节更新。
+    """
+    if fp.fp is None:
+        return 0
+    if fp.length is not None and len(view) > fp.length:
+        view = view[:fp.length]
+    size = fp.fp.readinto1(view)
+    if not size and view:
+        fp._close_conn()
+    elif fp.length is not None:
+        fp.length -= size
+        if not fp.length:
+            fp._close_conn()
+    return size
+
+
+def split_segments(total_size, segments):
+    count = max(1, min(segments, total_size // MIN_SEGMENT_SIZE))
+    step = total_size // count
+    bounds = [i * step for i in range(count)] + [total_size]
+    return [(bounds[i], bounds[i + 1] - 1) for i in range(count)]
 
 
 class DownloadThread(QThread):
-    update_single_progress = Signal(int)  # 更新单个文件进度
-    update_total_progress = Signal(int)   # 更新总进度
-    update_speed = Signal(str)   # 更新下载速度
+    update_progress = Signal(object)  # 完整的进度快照 DownloadProgress
+    download_started = Signal(str)  # url
+    download_complete = Signal(str)  # url
+    download_error = Signal(str, str)  # url, 错误信息
+    download_stopped = Signal(str, str)  # url, paused 或 removed
 
-    def __init__(self, urls, target_dir):
+    def __init__(self, urls, target_dir, preflight=None):
         super().__init__()
         self.urls = urls
         self.target_dir = target_dir
-        self.total_progress = 0
-        self.total_files = len(urls)
-        self.total_downloaded = 0
-        self.download_speed = 0
+        self.preflight = preflight or {}  # url -> PreflightResult
+        self.segments = cfg.get(cfg.download_segments)
+        self.max_workers = cfg.get(cfg.concurrent_files)
+        # 下载线程只更新计数, 信号由 progress 按固定频率合并发出
+        self.progress = ProgressReporter(self.publish_progress, {url: self.expected_size(url, self.preflight) for url in urls})
+        self.session = get_session()
+        self.stop_requests = {}  # url -> paused 或 removed
+        self.executor = None
+        self.futures = []  # (url, Future), 按提交顺序; enqueue 追加的也在其中
+        self.closed = False  # 已收齐所有结果, 不再接受 enqueue
+        self.lock = threading.Lock()
 
     def run(self):
-        """执行下载任务"""
-        for url in self.urls:
-            self.download_model(url)
+        """执行下载任务, 同时下载 max_workers 个文件"""
+        self.progress.start()
+        try:
+            if self.urls and cfg.get(cfg.auto_select_mirror):
+                mirror_selector.probe(self.urls[0])
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                with self.lock:
+                    self.executor = executor
+                    self.futures = [(url, executor.submit(self.download_model, url)) for url in self.urls]
+                index = 0
+                while True:
+                    with self.lock:
+                        if index == len(self.futures):
+                            self.closed = True
+                            break
+                        url, future = self.futures[index]
+                    index += 1
+                    # 单个文件出错不影响其他文件
+                    try:
+                        future.result()
+                    except NETWORK_ERRORS + (OSError,) as e:
+                        self.download_error.emit(url, str(e))
+        finally:
+            with self.lock:
+                self.closed = True
+            self.progress.stop()
+
+    def enqueue(self, url, preflight=None):
+        """把继续下载的文件加入这批, 有空闲的下载线程时立即开始; 这批已在收尾时返回 False。可在任意线程调用"""
+        with self.lock:
+            if self.closed or self.executor is None:
+                return False
+            self.stop_requests.pop(url, None)
+            if preflight is not None:
+                self.preflight[url] = preflight
+            if url not in self.urls:
+                self.urls.append(url)
+            self.futures.append((url, self.executor.submit(self.download_model, url)))
+        return True
+
+    def stop(self, urls=None, status=PAUSED):
+        """暂停(保留 .part 以便续传)或取消(删除 .part)指定的文件, 默认整批; 可在任意线程调用"""
+        for url in urls or self.urls:
+            self.stop_requests[url] = status
+
+    def check_stopped(self, url):
+        status = self.stop_requests.get(url)
+        if status is not None:
+            raise DownloadStopped(status)
 
     def download_model(self, url):
         model_filename = url.split("/")[-1]
         category = url.split("/")[-2]
         os.makedirs(os.path.join(self.target_dir, category), exist_ok=True)
         file_path = os.path.join(self.target_dir, category, model_filename)
-        
-        response = requests.get(url, stream=True)
-        total_size = int(response.headers.get('Content-Length', 0))
-
-        downloaded = 0
-        start_time = time.time()
-        last_downloaded = 0
-
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-
-                    self.update_single_progress.emit(int(downloaded / total_size * 100))
-
-                    elapsed_time = time.time() - start_time
-                    if elapsed_time > 1:
-                        self.download_speed = (downloaded - last_downloaded) / elapsed_time
-                        self.update_speed.emit(f"{self.download_speed / 1024 / 1024:.2f} MB/s")
-                        start_time = time.time()
-                        last_downloaded = downloaded
-
-        self.update_speed.emit("准备下载...")
-        self.total_progress += 1
-        self.update_total_progress.emit(int(self.total_progress / self.total_files * 100))
+        if url in self.stop_requests:
+            # 还没开始就被暂停或取消
+            self.stopped(url, PartFile(file_path, 0), self.stop_requests[url])
+            return
+
+        result = self.preflight.get(url)
+        if result is not None and result.ranged:
+            # 预检已经确认大小和 Range 支持, 省去一次探测请求
+            total_size, accept_ranges = result.size, True
+        else:
+            try:
+                total_size, accept_ranges = self.retry(url, lambda: self.probe(url))
+            except DownloadStopped as e:
+                # 探测请求退避等待时被暂停或取消
+                self.stopped(url, PartFile(file_path, 0), e.status)
+                return
+        etag = result.etag if result is not None else None
+        part = PartFile(file_path, total_size, models_info.get(model_filename, {}).get("sha256"), etag)
+
+        if accept_ranges and total_size:
+            if part.load():
+                part.catch_up()
+            else:
+                part.create(split_segments(total_size, self.segments))
+        else:
+            part.discard()
+
+        self.progress.begin(url, part.downloaded, total_size)
+        self.download_started.emit(url)
+        finished = False
+        try:
+            if part.segments:
+                self.download_segmented(url, part)
+            else:
+                self.download_stream(url, part)
+
+            digest = part.hexdigest()
+            if part.sha256 and digest != part.sha256:
+                # 校验失败的文件不改名, 连同进度记录一起删除
+                part.discard()
+                self.download_error.emit(url, f"sha256 mismatch (expected {part.sha256}, got {digest}), the file has been discarded")
+            else:
+                part.promote()
+                fingerprints.record(file_path, digest)
+                self.download_complete.emit(url)
+            finished = True
+        except DownloadStopped as e:
+            self.stopped(url, part, e.status)
+        finally:
+            self.progress.end(url, finished)
+            rate_limiter.release(url)
+
+    def stopped(self, url, part, status):
+        # 暂停时分段进度已保存, 继续下载时从 .part 续传; 不支持 Range 的文件只能重新下载
+        if status == REMOVED:
+            part.discard()
+        self.download_stopped.emit(url, status)
+
+    @staticmethod
+    def expected_size(url, preflight=None):
+        result = (preflight or {}).get(url)
+        if result is not None and result.size:
+            return result.size
+        return models_info.get(url.split("/")[-1], {}).get("model_size", 0)
+
+    def probe(self, url):
+        """用 Range: bytes=0-0 探测文件大小和服务器是否支持分段"""
+        response = self.request(url, {"Range": "bytes=0-0"})
+        content_range = response.headers.get('Content-Range', '')
+        if response.status_code == 206 and '/' in content_range:
+            # 读完这 1 字节, 连接才能放回连接池复用
+            response.content
+            total_size = content_range.rsplit('/', 1)[-1]
+            if total_size.isdigit():
+                return int(total_size), True
+        response.close()
+        return int(response.headers.get('Content-Length', 0)), False
+
+    def retry(self, url, attempt):
+        """调用 attempt, 可重试的错误按抖动的指数退避等待后再试, 超过设置的次数后抛出最后一次的错误"""
+        attempts = cfg.get(cfg.retry_attempts)
+        for i in range(attempts + 1):
+            try:
+                return attempt()
+            except NETWORK_ERRORS as e:
+                if i == attempts or not is_retryable(e):
+                    raise
+                retry_metrics.record(e)
+                self.progress.retry()
+                self.sleep(url, backoff_delay(i, e))
+
+    def sleep(self, url, delay):
+        # 等待期间仍可暂停或取消
+        deadline = time.monotonic() + delay
+        while True:
+            self.check_stopped(url)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.1))
+
+    def get(self, request_url, headers):
+        """请求 request_url, 已知其重定向目标时直接请求目标; 缓存的签名地址失效时重新解析一次"""
+        cached = redirect_cache.get(request_url)
+        response = self.session.get(cached or request_url, headers=headers, stream=True, timeout=get_timeout())
+        if cached and response.status_code in STALE_STATUS:
+            response.close()
+            redirect_cache.invalidate(request_url)
+            response = self.session.get(request_url, headers=headers, stream=True, timeout=get_timeout())
+        if response.history:
+            redirect_cache.store(request_url, response.url)
+        return response
+
+    def request(self, url, headers):
+        """按镜像排名依次尝试, 返回第一个成功的响应"""
+        for candidate in mirror_selector.candidates(url):
+            try:
+                response = self.get(candidate, headers)
+                try:
+                    response.raise_for_status()
+                except requests.exceptions.HTTPError:
+                    # 出错的响应也要关闭, 否则连接不会还给连接池, pool_block 下之后的请求会一直等待空闲连接
+                    response.close()
+                    raise
+                return response
+            except NETWORK_ERRORS as e:
+                mirror_selector.report_failure(candidate)
+                error = e
+        raise error
+
+    def download_stream(self, url, part):
+        self.retry(url, lambda: self.fetch_stream(url, part))
+
+    def fetch_stream(self, url, part):
+        # 服务器不支持 Range 时无法续传, 每次重试都从头下载
+        part.restart()
+        self.progress.begin(url, 0, part.size)
+        response = self.request(url, {"Accept-Encoding": "identity"})
+        if not part.size:
+            self.progress.set_total(url, int(response.headers.get('Content-Length', 0)))
+
+        with response, open(part.path, 'wb', buffering=0) as f:
+            self.copy_response(url, part, response, f, 0)
+
+    def download_segmented(self, url, part):
+        # 大文件的分段同时从多个镜像下载; 每次领取分段时按实测速度选择镜像,
+        # 先完成的线程按双方速度拆分别的分段接着下载, 慢镜像不会拖住快镜像的数据
+        if part.size >= cfg.get(cfg.mirror_race_min_size) * 1024 * 1024:
+            race = mirror_selector.race(url)
+        else:
+            race = MirrorRace([None])
+        workers = max(1, min(self.segments, len(part.pending)))
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(self.segment_worker, url, part, race) for _ in range(workers)]
+                for future in futures:
+                    future.result()
+        finally:
+            part.save(force=True)
+
+    def segment_worker(self, url, part, race):
+        while True:
+            self.check_stopped(url)
+            preferred = race.choose()
+            segment = part.claim(lambda victim: race.share(preferred, victim))
+            if segment is None:
+                return
+            race.begin(preferred, segment)
+            try:
+                self.download_segment(url, part, segment, preferred)
+            finally:
+                race.end(segment)
+
+    def download_segment(self, url, part, segment, preferred=None):
+        # 只重试出错的分段, 其他分段照常下载
+        self.retry(url, lambda: self.fetch_segment_from_mirrors(url, part, segment, preferred))
+        # 本段写完后, 后面已经写好的数据可以接着计入 sha256
+        part.catch_up()
+
+    def fetch_segment_from_mirrors(self, url, part, segment, preferred):
+        # 出错、读取超时或停滞时换下一个镜像, 从本段已完成的位置继续
+        for candidate in mirror_selector.candidates(url, preferred):
+            try:
+                self.fetch_segment(candidate, url, part, segment)
+                return
+            except NETWORK_ERRORS as e:
+                mirror_selector.report_failure(candidate)
+                error = e
+        raise error
+
+    def fetch_segment(self, request_url, url, part, segment):
+        start, end, done = segment
+        if start + done > end:
+            return
+
+        headers = {"Range": f"bytes={start + done}-{end}", "Accept-Encoding": "identity"}
+        response = self.get(request_url, headers)
+        if response.status_code != 206:
+            response.close()
+            raise requests.exceptions.HTTPError(f"Server ignored Range request for {request_url}", response=response)
+
+        # 不经过用户态缓冲直接写入, 保证记录的进度不超过已落盘的数据
+        with response, open(part.path, 'r+b', buffering=0) as f:
+            f.seek(start + done)
+            self.copy_response(url, part, response, f, start + done, segment)
+
+    def copy_response(self, url, part, response, f, offset, segment=None):
+        """读取响应体并写入 f, 按实际收到的字节数判断是否停滞"""
+        stall = StallDetector(cfg.get(cfg.stall_speed) * 1024, cfg.get(cfg.stall_timeout))
+        offset = self.read_response(url, part, response, f, offset, segment, stall)
+        # http.client 在连接提前断开时只返回 0, 不会报错
+        end = segment[1] + 1 if segment is not None else part.size
+        if end and offset < end:
+            raise http.client.IncompleteRead(b"", end - offset)
+
+    def read_response(self, url, part, response, f, offset, segment, stall):
+        """用可复用的大缓冲区 readinto 读取响应体, 不为每个小块创建 bytes 对象; 返回写到的位置"""
+        readinto = self.get_readinto(response)
+        view = memoryview(bytearray(BUFFER_SIZE))
+        while True:
+            self.check_stopped(url)
+            if segment is None:
+                size = readinto(view)
+            else:
+                # 分段可能被其他线程拆分, 每次读取前按当前的结束位置限制读取量
+                remaining = segment[1] - offset + 1
+                if remaining <= 0:
+                    return offset
+                size = readinto(view[:min(BUFFER_SIZE, remaining)])
+            if not size:
+                break
+            stall.feed(size)
+            if stall.check():
+                raise DownloadStalled(stall.message)
+            chunk = view[:size]
+            f.write(chunk)
+            part.feed(offset, chunk)
+            offset += size
+            self.progress.add(url, size)
+            if segment is not None:
+                segment[2] += size
+                part.save()
+            delay = rate_limiter.consume(url, size)
+            if delay:
+                stall.exclude(delay)
+                self.sleep(url, delay)
+        # 响应体已读完, 把 keep-alive 连接放回连接池; 提前返回时连接随响应一起关闭
+        response.raw.release_conn()
+        return offset
+
+    @staticmethod
+    def get_readinto(response):
+        # urllib3 的 readinto 内部仍是 read() 后再拷贝, 响应未压缩时直接读底层的 http.client 响应
+        fp = getattr(response.raw, '_fp', None)
+        if fp is not None and not getattr(fp, 'chunked', True) and not response.headers.get('Content-Encoding'):
+            return lambda view: readinto1(fp, view)
+        return response.raw.readinto
+
+    def publish_progress(self, progress):
+        self.update_progress.emit(progress)
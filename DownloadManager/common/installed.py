@@ -0,0 +1,85 @@
+import os
+import json
+import threading
+from .data import models_info
+
+FINGERPRINTS_PATH = "./data/fingerprints.json"
+
+
+class FingerprintCache:
+    """记录已校验过 sha256 的模型文件: 路径 -> (大小, 修改时间, sha256)
+
+    文件的大小和修改时间都没变时, 沿用记录的 sha256, 不必重新读取整个文件。
+    """
+
+    def __init__(self, path=FINGERPRINTS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def get(self, file_path):
+        """文件未变化时返回记录的 sha256, 否则返回 None"""
+        key = os.path.abspath(file_path)
+        with self.lock:
+            entry = self.load().get(key)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        if entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            return None
+        return entry["sha256"]
+
+    def record(self, file_path, sha256):
+        stat = os.stat(file_path)
+        with self.lock:
+            self.load()[os.path.abspath(file_path)] = {
+                "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=4)
+            os.replace(tmp_path, self.path)
+
+
+fingerprints = FingerprintCache()
+
+
+def is_complete(file_path):
+    """直接下载完成后才把 .part 改名为正式文件名, 文件存在即完整;
+    Aria2 直接写正式文件名, 下载中还留有 <文件>.aria2 控制文件"""
+    return os.path.exists(file_path) and not os.path.exists(file_path + ".aria2")
+
+
+def check_installed(model_filename):
+    """返回 (是否已安装, 原因); 文件不存在时原因为 None"""
+    info = models_info.get(model_filename, {})
+    file_path = info.get("target_position")
+    if not file_path or not os.path.exists(file_path):
+        return False, None
+    if not is_complete(file_path):
+        return False, "incomplete Aria2 download"
+
+    size = os.path.getsize(file_path)
+    expected_size = info.get("model_size")
+    if expected_size and size != expected_size:
+        return False, f"size mismatch ({size} bytes on disk, expected {expected_size})"
+
+    sha256 = fingerprints.get(file_path)
+    if sha256 is None:
+        # 没有校验记录的文件只比较大小, 完整校验可在模型管理页面进行
+        return True, "size matches"
+    if info.get("sha256") and sha256 != info["sha256"]:
+        return False, "sha256 mismatch"
+    return True, "sha256 verified"
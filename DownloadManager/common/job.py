@@ -0,0 +1,42 @@
+from .data import models_info
+
+# 任务状态沿用 aria2 的叫法
+WAITING = "waiting"
+ACTIVE = "active"
+PAUSED = "paused"
+COMPLETE = "complete"
+ERROR = "error"
+REMOVED = "removed"
+FINAL_STATUSES = (COMPLETE, ERROR, REMOVED)
+
+
+class DownloadJob:
+    """一个模型文件的下载任务, 所有下载后端共用"""
+
+    def __init__(self, url):
+        self.url = url
+        self.filename = url.split("/")[-1]
+        self.category = url.split("/")[-2]
+        self.status = WAITING
+        self.error = None
+        self.backend = None  # 负责这个任务的后端名称
+        self.gid = None  # 提交给 Aria2 后得到的 GID
+        self.downloaded = 0  # 已下载的字节数, 来自后端的进度快照
+        self.priority = 0  # 用户在标签栏中排的顺序, 越小越先下载
+        self.preflight = None  # 提交前 HEAD 得到的 PreflightResult
+        self.rate_limit = None  # 单独设置的限速(MB/s), None 时用设置中的单文件限速, 0 为不限速
+
+    @property
+    def size(self):
+        # 优先用预检得到的实际大小, 没有时用 models_info 记录的大小
+        if self.preflight is not None and self.preflight.size:
+            return self.preflight.size
+        return models_info.get(self.filename, {}).get("model_size", 0)
+
+    @property
+    def sha256(self):
+        return models_info.get(self.filename, {}).get("sha256")
+
+    @property
+    def is_final(self):
+        return self.status in FINAL_STATUSES
@@ -0,0 +1,98 @@
+import os
+import json
+import threading
+from .job import DownloadJob, FINAL_STATUSES
+
+JOURNAL_PATH = "./data/download_queue.jsonl"
+JOURNAL_INTERVAL = 1  # 合并写入日志的间隔(秒)
+PROGRESS_STEP = 64 * 1024 * 1024  # 只有下载量变化时, 至少变化这么多字节才再写一行
+COMPACT_MIN_LINES = 1000  # 日志超过这么多行, 且超过未完成任务数的 4 倍时压缩
+
+
+class DownloadJournal:
+    """只追加的下载队列日志, 每行是某个任务在某一时刻的状态, 同一 url 以最后一行为准
+
+    分段进度仍以 <文件名>.part.json 为准, 日志只记录任务本身, 用来在重启后恢复未完成的任务。
+    行数远多于未完成的任务时, 在写入后压缩为只含这些任务的最后一条记录。
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self.pending = {}  # url -> 尚未写入的记录, 同一任务的多次变化只写最后一次
+        self.written = {}  # url -> 最后写入的记录
+        self.lines = 0  # 日志中的行数, 不含启动前已有而未经 load 压缩的部分
+        self.lock = threading.Lock()
+
+    def record(self, job):
+        record = {
+            "url": job.url,
+            "backend": job.backend,
+            "status": job.status,
+            "downloaded": job.downloaded,
+            "gid": job.gid,
+            "priority": job.priority,
+            "rate_limit": job.rate_limit,
+        }
+        with self.lock:
+            # 进度每次刷新都会记录所有未完成的任务, 只有状态等变化或下载量变化较大时才写入
+            last = self.pending.get(job.url) or self.written.get(job.url)
+            if last is not None and self.unchanged(last, record):
+                return
+            self.pending[job.url] = record
+
+    @staticmethod
+    def unchanged(last, record):
+        if any(last.get(key) != value for key, value in record.items() if key != "downloaded"):
+            return False
+        return abs(record["downloaded"] - last.get("downloaded", 0)) < PROGRESS_STEP
+
+    def flush(self):
+        with self.lock:
+            records, self.pending = list(self.pending.values()), {}
+            self.written.update((record["url"], record) for record in records)
+        if not records:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+        self.lines += len(records)
+        outstanding = sum(record["status"] not in FINAL_STATUSES for record in self.written.values())
+        if self.lines > max(COMPACT_MIN_LINES, 4 * outstanding):
+            self.compact()
+
+    def compact(self):
+        """把日志压缩为只含未完成任务最后一条记录, 返回这些记录"""
+        records = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 写到一半中断的最后一行
+                        continue
+                    records[record["url"]] = record
+
+        outstanding = [record for record in records.values() if record["status"] not in FINAL_STATUSES]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("".join(json.dumps(record) + "\n" for record in outstanding))
+        os.replace(tmp_path, self.path)
+        self.lines = len(outstanding)
+        return outstanding
+
+    def load(self):
+        """读取未完成的任务, 并把日志压缩为只含这些任务的记录"""
+        outstanding = self.compact()
+        with self.lock:
+            self.written.update((record["url"], record) for record in outstanding)
+        jobs = []
+        for record in outstanding:
+            job = DownloadJob(record["url"])
+            job.backend = record["backend"]
+            job.status = record["status"]
+            job.downloaded = record.get("downloaded", 0)
+            job.gid = record.get("gid")
+            job.priority = record.get("priority", 0)
+            job.rate_limit = record.get("rate_limit")
+            jobs.append(job)
+        return jobs
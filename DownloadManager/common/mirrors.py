@@ -0,0 +1,172 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from .data import HF_ENDPOINTS
+from .session import get_session, get_timeout
+
+PROBE_BYTES = 2 * 1024 * 1024  # 测速时每个端点最多下载的字节数
+PROBE_WINDOW = 3  # 测速时间窗口(秒)
+PROBE_TTL = 600  # 测速结果的有效期(秒)
+MEASURE_MIN_TIME = 0.5  # 分段至少下载这么久后才用实测速度代替之前的估计(秒)
+
+
+class MirrorSelector:
+    """对多个 HF 端点测速排序, 下载走最快的端点, 出错或卡住时切换到下一个"""
+
+    def __init__(self, endpoints):
+        self.endpoints = [endpoint.rstrip("/") for endpoint in endpoints]
+        self.ranking = list(self.endpoints)
+        self.results = {}  # endpoint -> (首字节时间, 吞吐量 字节/秒)
+        self.probed_at = 0
+        self.lock = threading.Lock()
+
+    def split(self, url):
+        """把 URL 拆成 (端点, 仓库内路径), 不属于任何端点时端点为 None"""
+        for endpoint in self.endpoints:
+            if url.startswith(endpoint + "/"):
+                return endpoint, url[len(endpoint):]
+        return None, url
+
+    def candidates(self, url, preferred=None):
+        """按当前排名把 url 换到各个端点上, 依次作为备选; preferred 指定的 URL 排在最前"""
+        endpoint, path = self.split(url)
+        if endpoint is None:
+            return [url]
+        with self.lock:
+            urls = [endpoint + path for endpoint in self.ranking]
+        if preferred in urls:
+            urls.remove(preferred)
+            urls.insert(0, preferred)
+        return urls
+
+    def race_candidates(self, url):
+        """可同时使用的端点上的 url, 排除上次测速失败的端点"""
+        endpoint, path = self.split(url)
+        if endpoint is None:
+            return [url]
+        with self.lock:
+            endpoints = [endpoint for endpoint in self.ranking if self.results.get(endpoint, (0, 1))[1] > 0]
+        return [endpoint + path for endpoint in endpoints] or [url]
+
+    def race(self, url):
+        """为一个文件的分段下载创建 MirrorRace, 以测速得到的吞吐量作为各端点的初始速度"""
+        urls = self.race_candidates(url)
+        speeds = {}
+        with self.lock:
+            for candidate in urls:
+                endpoint, _ = self.split(candidate)
+                throughput = self.results.get(endpoint, (0, 0))[1]
+                if throughput > 0:
+                    speeds[candidate] = throughput
+        return MirrorRace(urls, speeds)
+
+    def probe(self, url, force=False):
+        """用 url 对应的文件在所有端点上测速, 结果在 PROBE_TTL 内复用"""
+        endpoint, path = self.split(url)
+        if endpoint is None or len(self.endpoints) < 2:
+            return
+        if not force and time.time() - self.probed_at < PROBE_TTL:
+            return
+
+        with ThreadPoolExecutor(max_workers=len(self.endpoints)) as executor:
+            measured = executor.map(lambda endpoint: self.measure(endpoint + path), self.endpoints)
+            results = dict(zip(self.endpoints, measured))
+
+        with self.lock:
+            self.results = results
+            # 吞吐量高的优先, 相同时首字节时间短的优先
+            self.ranking = sorted(self.endpoints, key=lambda endpoint: (-results[endpoint][1], results[endpoint][0]))
+            self.probed_at = time.time()
+
+    @staticmethod
+    def measure(url):
+        start = time.time()
+        headers = {"Range": f"bytes=0-{PROBE_BYTES - 1}", "Accept-Encoding": "identity"}
+        try:
+            response = get_session().get(url, headers=headers, stream=True, timeout=get_timeout())
+            with response:
+                response.raise_for_status()
+                ttfb = None
+                received = 0
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    if ttfb is None:
+                        ttfb = time.time() - start
+                        first_byte = time.time()
+                    received += len(chunk)
+                    if time.time() - start > PROBE_WINDOW:
+                        break
+        except requests.exceptions.RequestException:
+            return math.inf, 0
+
+        if ttfb is None:
+            return math.inf, 0
+        elapsed_time = time.time() - first_byte
+        return ttfb, received / elapsed_time if elapsed_time > 0 else received
+
+    def report_failure(self, url):
+        """请求出错或卡住时把对应端点排到最后"""
+        endpoint, _ = self.split(url)
+        if endpoint is None:
+            return
+        with self.lock:
+            self.ranking.remove(endpoint)
+            self.ranking.append(endpoint)
+
+
+class MirrorRace:
+    """一个文件分段下载期间各镜像单个连接的实测速度
+
+    每次领取分段时选当前最快的镜像, 拆分别的分段时按双方速度决定比例,
+    慢镜像上的线程只分到它能和快线程同时下完的那部分。
+    """
+
+    def __init__(self, urls, speeds=None):
+        self.urls = urls
+        self.speeds = dict(speeds or {})  # url -> 单连接速度(字节/秒), 先用测速结果, 下载中换成实测值
+        self.running = {}  # 分段起点 -> [url, 分段, 开始时间, 开始时已完成的字节数]
+        self.lock = threading.Lock()
+
+    def choose(self):
+        """领取分段前选择镜像: 还没有速度数据的镜像轮流试用, 否则用单连接最快的"""
+        with self.lock:
+            self.measure()
+            unknown = [url for url in self.urls if url not in self.speeds]
+            if unknown:
+                return min(unknown, key=lambda url: sum(worker[0] == url for worker in self.running.values()))
+            return max(self.urls, key=self.speeds.get)
+
+    def begin(self, url, segment):
+        with self.lock:
+            self.running[segment[0]] = [url, segment, time.time(), segment[2]]
+
+    def end(self, segment):
+        with self.lock:
+            self.measure()
+            self.running.pop(segment[0], None)
+
+    def share(self, url, victim):
+        """在 url 上领取的线程从 victim 拆走的比例, 使两边大致同时下完"""
+        with self.lock:
+            mine = self.speeds.get(url)
+            worker = self.running.get(victim[0])
+            theirs = self.speeds.get(worker[0]) if worker else None
+            if worker and time.time() - worker[2] >= MEASURE_MIN_TIME:
+                theirs = (victim[2] - worker[3]) / (time.time() - worker[2])
+        if not mine or not theirs:
+            return 0.5
+        return mine / (mine + theirs)
+
+    def measure(self):
+        # 同一镜像上正在下载的分段取平均速度, 下载刚开始的分段不计
+        now = time.time()
+        measured = {}
+        for url, segment, started, done in self.running.values():
+            if now - started >= MEASURE_MIN_TIME:
+                measured.setdefault(url, []).append((segment[2] - done) / (now - started))
+        for url, speeds in measured.items():
+            self.speeds[url] = sum(speeds) / len(speeds)
+
+
+mirror_selector = MirrorSelector(HF_ENDPOINTS)
@@ -0,0 +1,204 @@
+import os
+import json
+import hashlib
+import threading
+import time
+from .config import cfg
+
+SAVE_INTERVAL = 1  # 进度记录最短保存间隔(秒)
+HASH_BLOCK_SIZE = 1024 * 1024
+STEAL_MIN_SIZE = 2 * 1024 * 1024  # 拆分时两边都至少保留这么多, 拆分点至少离当前位置两个读缓冲区
+
+
+def sync_file(path):
+    """把文件数据写入磁盘; 只需要数据落盘时用 fdatasync, 不必等元数据"""
+    fd = os.open(path, os.O_RDWR)
+    try:
+        if hasattr(os, "fdatasync"):
+            os.fdatasync(fd)
+        else:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_dir(path):
+    # 改名要等所在目录写入磁盘才算持久; Windows 不能打开目录, 也不需要这一步
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class PartFile:
+    """下载中的 <file>.part 以及记录分段进度的 <file>.part.json"""
+
+    def __init__(self, file_path, size, sha256=None, etag=None):
+        self.file_path = file_path
+        self.path = file_path + ".part"
+        self.state_path = file_path + ".part.json"
+        self.size = size
+        self.sha256 = sha256
+        self.etag = etag  # 预检得到的 ETag, 服务器上的文件变了就不能续传
+        # none: 交给操作系统; end: 改名前写入磁盘; periodic: 每次保存进度前也写入, 断电后续传不会跳过未落盘的数据
+        self.fsync_policy = cfg.get(cfg.fsync_policy)
+        self.segments = []  # [start, end, done]
+        self.claimed = set()  # 已有线程负责的分段的 start
+        self.segment_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.last_save = 0
+        # 边下载边计算 sha256, hashed 之前的字节已计入
+        self.hash = hashlib.sha256()
+        self.hashed = 0
+        self.hash_lock = threading.Lock()
+
+    @property
+    def downloaded(self):
+        return sum(done for _, _, done in self.segments)
+
+    def load(self):
+        """读取上次中断留下的进度, 与本次的大小和 sha256 一致时才续传"""
+        if not (os.path.exists(self.path) and os.path.exists(self.state_path)):
+            return False
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if state.get("size") != self.size or state.get("sha256") != self.sha256:
+            return False
+        if self.etag and state.get("etag") and state["etag"] != self.etag:
+            return False
+        if os.path.getsize(self.path) != self.size:
+            return False
+        self.segments = [list(segment) for segment in state["segments"]]
+        return True
+
+    def create(self, segments):
+        # 预分配 .part 文件, 各分段按偏移写入
+        with open(self.path, 'wb') as f:
+            self.preallocate(f)
+        self.segments = [[start, end, 0] for start, end in segments]
+        self.save(force=True)
+
+    def preallocate(self, f):
+        """支持 fallocate 的文件系统上真正占用磁盘空间, 避免下载到一半时磁盘写满; 否则只设置文件大小"""
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, self.size)
+                return
+            except OSError:
+                pass
+        f.truncate(self.size)
+
+    def save(self, force=False):
+        if not force and time.time() - self.last_save < SAVE_INTERVAL:
+            return
+        with self.lock:
+            self.last_save = time.time()
+            with self.segment_lock:
+                segments = [list(segment) for segment in self.segments]
+            state = {"size": self.size, "sha256": self.sha256, "etag": self.etag, "segments": segments}
+            if self.fsync_policy == "periodic":
+                # 记录的进度不能超过已落盘的数据
+                sync_file(self.path)
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+                if self.fsync_policy == "periodic":
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self.state_path)
+
+    @property
+    def pending(self):
+        return [segment for segment in self.segments if segment[0] + segment[2] <= segment[1]]
+
+    def claim(self, share=None):
+        """领取一个还没有线程负责的分段, 没有时从别的分段拆出后面的一部分
+
+        share(victim) 返回拆给新线程的比例, 默认一半; 拆出的部分太小时不拆分。
+        """
+        with self.segment_lock:
+            for segment in self.pending:
+                if segment[0] not in self.claimed:
+                    self.claimed.add(segment[0])
+                    return segment
+
+            victim, size = None, 0
+            for segment in self.pending:
+                remaining = segment[1] - segment[0] - segment[2] + 1
+                stolen = int(remaining * (share(segment) if share else 0.5))
+                # 拆分点离当前位置足够远, 负责 victim 的线程每次读取前才看 victim[1], 正在进行的读取不会越界
+                if STEAL_MIN_SIZE <= stolen <= remaining - STEAL_MIN_SIZE and stolen > size:
+                    victim, size = segment, stolen
+            if victim is None:
+                return None
+            middle = victim[1] + 1 - size
+            segment = [middle, victim[1], 0]
+            victim[1] = middle - 1
+            self.segments.append(segment)
+            self.claimed.add(middle)
+            return segment
+
+    def feed(self, offset, data):
+        """写入的数据恰好接在已校验部分之后时直接计入 sha256, 否则留给 catch_up 从磁盘补读"""
+        with self.hash_lock:
+            if offset == self.hashed:
+                self.hash.update(data)
+                self.hashed += len(data)
+
+    def restart(self):
+        """不支持 Range 的文件重新从头下载, sha256 也从头计算"""
+        with self.hash_lock:
+            self.hash = hashlib.sha256()
+            self.hashed = 0
+
+    def catch_up(self, limit=None):
+        """从磁盘补读 hashed 到 limit 之间已写入的数据, 默认到分段中连续写完的位置"""
+        with self.hash_lock:
+            if limit is None:
+                limit = self.contiguous()
+            if limit <= self.hashed:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self.hashed)
+                while self.hashed < limit:
+                    block = f.read(min(HASH_BLOCK_SIZE, limit - self.hashed))
+                    if not block:
+                        break
+                    self.hash.update(block)
+                    self.hashed += len(block)
+
+    def contiguous(self):
+        position = 0
+        for start, end, done in sorted(self.segments):
+            if start != position:
+                break
+            position = start + done
+            if position <= end:
+                break
+        return position
+
+    def hexdigest(self):
+        self.catch_up(os.path.getsize(self.path))
+        return self.hash.hexdigest()
+
+    def promote(self):
+        """下载完成后改名为正式文件名; 正式文件名一出现, 文件就是完整的, 断电后也是如此"""
+        if self.fsync_policy != "none":
+            sync_file(self.path)
+        os.replace(self.path, self.file_path)
+        if self.fsync_policy != "none":
+            sync_dir(os.path.dirname(os.path.abspath(self.file_path)))
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    def discard(self):
+        for path in (self.path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
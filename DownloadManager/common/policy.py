@@ -0,0 +1,27 @@
+from itertools import zip_longest
+
+# 调度策略, 决定一批任务交给下载引擎的先后顺序
+SELECTION = "selection"  # 按选择模型时的分类顺序
+SHORTEST = "shortest"  # 小文件优先, 尽快让更多模型可用
+PRIORITY = "priority"  # 按用户在标签栏中排的顺序
+FAIR = "fair"  # 各分类轮流, 每个分类内小文件优先
+SCHEDULING_POLICIES = [SELECTION, SHORTEST, PRIORITY, FAIR]
+
+
+def size_key(job):
+    # 大小未知的任务排在最后
+    return job.size or float("inf")
+
+
+def order_jobs(jobs, policy):
+    """按调度策略排序, 下载引擎按返回的顺序占用并发名额"""
+    if policy == SHORTEST:
+        return sorted(jobs, key=size_key)
+    if policy == PRIORITY:
+        return sorted(jobs, key=lambda job: (job.priority, size_key(job)))
+    if policy == FAIR:
+        categories = {}
+        for job in sorted(jobs, key=size_key):
+            categories.setdefault(job.category, []).append(job)
+        return [job for jobs in zip_longest(*categories.values()) for job in jobs if job is not None]
+    return list(jobs)
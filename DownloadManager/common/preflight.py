@@ -0,0 +1,69 @@
+from PySide6.QtCore import QThread, Signal
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from .mirrors import mirror_selector
+from .redirects import redirect_cache
+from .session import get_session, get_timeout
+
+PREFLIGHT_WORKERS = 16  # 同时进行的 HEAD 请求数, 实际还受每个主机的连接数限制
+
+
+class PreflightResult:
+    """一个 url 的 HEAD 结果, 请求失败时 error 不为空, 其余字段为默认值"""
+
+    def __init__(self, url, size=0, etag=None, accept_ranges=False, final_url=None, error=None):
+        self.url = url
+        self.size = size  # Content-Length, 未知时为 0
+        self.etag = etag
+        self.accept_ranges = accept_ranges
+        self.final_url = final_url or url  # 重定向后的地址
+        self.error = error
+
+    @property
+    def ranged(self):
+        """大小已知且支持 Range, 下载时可以直接分段, 不必再探测"""
+        return self.accept_ranges and self.size > 0
+
+
+def head(url):
+    """按镜像排名依次 HEAD, 跟随重定向; 重定向目标记入 redirect_cache, 下载时直接使用"""
+    error = None
+    for candidate in mirror_selector.candidates(url):
+        try:
+            response = get_session().head(candidate, allow_redirects=True, timeout=get_timeout())
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            error = e
+            continue
+        if response.history:
+            redirect_cache.store(candidate, response.url)
+        headers = response.headers
+        length = headers.get("Content-Length", "")
+        return PreflightResult(
+            url,
+            size=int(length) if length.isdigit() else 0,
+            etag=headers.get("ETag"),
+            accept_ranges=headers.get("Accept-Ranges", "").lower() == "bytes",
+            final_url=response.url,
+        )
+    return PreflightResult(url, error=str(error))
+
+
+def preflight(urls):
+    """并发 HEAD 所有 url, 返回 url -> PreflightResult"""
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(PREFLIGHT_WORKERS, len(urls))) as executor:
+        return dict(zip(urls, executor.map(head, urls)))
+
+
+class PreflightThread(QThread):
+    """在后台线程中预检一批任务, 不阻塞界面"""
+    done = Signal(dict)  # url -> PreflightResult
+
+    def __init__(self, jobs):
+        super().__init__()
+        self.jobs = jobs
+
+    def run(self):
+        self.done.emit(preflight([job.url for job in self.jobs]))
@@ -0,0 +1,164 @@
+import math
+import asyncio
+import threading
+import time
+
+PUBLISH_INTERVAL = 0.1  # 发布进度的间隔(秒), 即 10 Hz
+SPEED_TIME_CONSTANT = 3  # 下载速度指数滑动平均的时间常数(秒)
+
+
+class DownloadProgress:
+    """某一时刻整批下载的进度, 由 ProgressReporter 生成"""
+
+    def __init__(self, active, downloaded, total_size, finished, total_files, batch_downloaded, batch_size, speed,
+                 files=None, retries=0):
+        self.active = active  # 正在下载的文件数
+        self.downloaded = downloaded  # 正在下载的文件已完成的字节数
+        self.total_size = total_size  # 正在下载的文件的总字节数
+        self.finished = finished
+        self.total_files = total_files
+        self.batch_downloaded = batch_downloaded
+        self.batch_size = batch_size
+        self.speed = speed  # 字节/秒
+        self.files = files or {}  # 文件 key(url 或 GID) -> 已下载字节数
+        self.retries = retries  # 本批下载中重试的次数
+
+    @property
+    def percent(self):
+        return int(self.downloaded / self.total_size * 100) if self.total_size else 0
+
+    @property
+    def batch_percent(self):
+        if self.batch_size:
+            return int(self.batch_downloaded / self.batch_size * 100)
+        return int(self.finished / self.total_files * 100) if self.total_files else 0
+
+    @property
+    def eta(self):
+        """正在下载的文件剩余时间(秒), 未知时为 None"""
+        return self.remaining_time(self.total_size - self.downloaded)
+
+    @property
+    def batch_eta(self):
+        """整批剩余时间(秒), 未知时为 None"""
+        return self.remaining_time(self.batch_size - self.batch_downloaded)
+
+    @classmethod
+    def combine(cls, progresses):
+        """把多个后端的进度相加, 用于同时显示直接下载和 Aria2 任务"""
+        fields = ["active", "downloaded", "total_size", "finished", "total_files", "batch_downloaded", "batch_size", "speed", "retries"]
+        combined = cls(**{field: sum(getattr(progress, field) for progress in progresses) for field in fields})
+        for progress in progresses:
+            combined.files.update(progress.files)
+        return combined
+
+    def remaining_time(self, remaining):
+        if remaining <= 0:
+            return 0
+        if self.speed <= 0:
+            return None
+        return remaining / self.speed
+
+
+class ProgressReporter:
+    """下载线程只累加字节计数, 由单独的线程按固定频率把进度快照交给 publish
+
+    expected_sizes 是整批文件预计的大小(来自 models_info 的 model_size), 总进度按字节加权。
+    """
+
+    def __init__(self, publish, expected_sizes=None, interval=PUBLISH_INTERVAL):
+        self.publish = publish
+        self.interval = interval
+        self.files = {key: [0, size or 0, False] for key, size in (expected_sizes or {}).items()}  # key -> [已下载字节, 文件大小, 是否正在下载]
+        self.finished = 0
+        self.total_downloaded = 0  # 本次实际从网络收到的字节数, 用于测速
+        self.retries = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.speed = 0
+        self.last_time = 0
+        self.last_downloaded = 0
+
+    def begin(self, key, downloaded, total_size):
+        with self.lock:
+            entry = self.files.setdefault(key, [0, 0, False])
+            entry[0] = downloaded
+            entry[2] = True
+            if total_size:
+                entry[1] = total_size
+
+    def set_total(self, key, total_size):
+        with self.lock:
+            self.files[key][1] = total_size
+
+    def add(self, key, size):
+        with self.lock:
+            self.files[key][0] += size
+            self.total_downloaded += size
+
+    def retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def end(self, key, finished=True):
+        with self.lock:
+            entry = self.files[key]
+            entry[2] = False
+            if finished:
+                entry[0] = max(entry[0], entry[1])
+                self.finished += 1
+
+    def start(self):
+        self.last_time = time.time()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.publish(self.snapshot())
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            self.publish(self.snapshot())
+
+    async def run_async(self):
+        """在 asyncio 事件循环中代替 start() 的发布线程, 取消任务后调用 stop()"""
+        self.last_time = time.time()
+        self.stopped.clear()
+        while True:
+            await asyncio.sleep(self.interval)
+            self.publish(self.snapshot())
+
+    def snapshot(self):
+        with self.lock:
+            active = [entry for entry in self.files.values() if entry[2]]
+            total_downloaded = self.total_downloaded
+            progress = DownloadProgress(
+                active=len(active),
+                downloaded=sum(entry[0] for entry in active),
+                total_size=sum(entry[1] for entry in active),
+                finished=self.finished,
+                total_files=len(self.files),
+                batch_downloaded=sum(min(entry[0], entry[1]) for entry in self.files.values()),
+                batch_size=sum(entry[1] for entry in self.files.values()),
+                speed=0,
+                files={key: entry[0] for key, entry in self.files.items()},
+                retries=self.retries,
+            )
+
+        # 按实际间隔折算权重的指数滑动平均, 不受发布频率影响
+        now = time.time()
+        elapsed_time = now - self.last_time
+        if elapsed_time > 0:
+            rate = (total_downloaded - self.last_downloaded) / elapsed_time
+            alpha = 1 - math.exp(-elapsed_time / SPEED_TIME_CONSTANT)
+            self.speed = rate if self.speed == 0 else alpha * rate + (1 - alpha) * self.speed
+            self.last_time = now
+            self.last_downloaded = total_downloaded
+        progress.speed = self.speed
+        return progress
@@ -0,0 +1,92 @@
+import threading
+import time
+from .config import cfg
+
+BURST_TIME = 1  # 空闲时最多积攒多少秒的令牌
+
+
+class TokenBucket:
+    """令牌桶限速, rate 单位为字节/秒, 0 为不限速; 可在任意线程调用"""
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = 0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate * BURST_TIME, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def set_rate(self, rate):
+        with self.lock:
+            # 之前的令牌和欠账按原来的速度结算
+            self.refill()
+            self.rate = rate
+
+    def reserve(self, size):
+        """取走 size 个令牌, 返回需要等待的秒数; 令牌不足时先记为欠账, 调用方等待后即还清"""
+        with self.lock:
+            if not self.rate:
+                return 0
+            self.refill()
+            self.tokens -= size
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class RateLimiter:
+    """全局限速加上每个文件各自的限速, 所有下载引擎、文件和分段共用
+
+    限速值来自设置, 在设置页面修改后立即生效, 不需要重新开始下载;
+    单个任务可以用 set_limit 另设限速, 代替设置中的单文件限速。
+    """
+
+    def __init__(self):
+        self.total = TokenBucket(cfg.get(cfg.rate_limit) * 1024 * 1024)
+        self.files = {}  # url -> 该文件的 TokenBucket
+        self.limits = {}  # url -> 单独设置的限速(MB/s)
+        self.lock = threading.Lock()
+        cfg.rate_limit.valueChanged.connect(self.total_limit_changed)
+        cfg.file_rate_limit.valueChanged.connect(self.file_limit_changed)
+
+    def total_limit_changed(self, value):
+        self.total.set_rate(value * 1024 * 1024)
+
+    def file_limit_changed(self, value):
+        with self.lock:
+            # 单独设置了限速的任务不受影响
+            buckets = [bucket for url, bucket in self.files.items() if url not in self.limits]
+        for bucket in buckets:
+            bucket.set_rate(value * 1024 * 1024)
+
+    def set_limit(self, url, rate):
+        """设置 url 单独的限速(MB/s), None 时恢复为单文件限速; 正在下载时立即生效"""
+        with self.lock:
+            if rate is None:
+                self.limits.pop(url, None)
+            else:
+                self.limits[url] = rate
+            bucket = self.files.get(url)
+            rate = self.file_rate(url)
+        if bucket is not None:
+            bucket.set_rate(rate)
+
+    def file_rate(self, url):
+        return self.limits.get(url, cfg.get(cfg.file_rate_limit)) * 1024 * 1024
+
+    def consume(self, url, size):
+        """记下 url 收到的 size 字节, 返回为遵守限速需要等待的秒数"""
+        with self.lock:
+            bucket = self.files.get(url)
+            if bucket is None:
+                bucket = self.files[url] = TokenBucket(self.file_rate(url))
+        return max(self.total.reserve(size), bucket.reserve(size))
+
+    def release(self, url):
+        with self.lock:
+            self.files.pop(url, None)
+            self.limits.pop(url, None)
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,76 @@
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs
+
+DEFAULT_TTL = 300  # 看不出有效期的重定向地址缓存多久(秒)
+EXPIRY_MARGIN = 60  # 签名地址在过期前多久就不再使用(秒), 留出完成一次请求的时间
+STALE_STATUS = (403, 410)  # 签名过期或地址作废时 CDN 返回的状态码
+
+
+def resolve_key(url):
+    """HF 的 <端点>/<仓库>/resolve/<版本>/<文件路径> 拆成 (主机, 仓库, 版本, 文件路径), 其他地址返回 None"""
+    parts = urlsplit(url)
+    repo, separator, rest = parts.path.partition("/resolve/")
+    if not separator or "/" not in rest:
+        return None
+    revision, filename = rest.split("/", 1)
+    return parts.netloc, repo.strip("/"), revision, filename
+
+
+def signed_expiry(url):
+    """签名地址的过期时间(时间戳), 支持 CloudFront 的 Expires 和 S3 的 X-Amz-Date + X-Amz-Expires"""
+    query = parse_qs(urlsplit(url).query)
+    expires = query.get("Expires", [""])[0]
+    if expires.isdigit():
+        return int(expires)
+    amz_date = query.get("X-Amz-Date", [""])[0]
+    amz_expires = query.get("X-Amz-Expires", [""])[0]
+    if amz_date and amz_expires.isdigit():
+        try:
+            signed_at = datetime.strptime(amz_date, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+        except ValueError:
+            return None
+        return signed_at.timestamp() + int(amz_expires)
+    return None
+
+
+class RedirectCache:
+    """resolve 地址重定向后的最终地址(CDN 或 LFS 存储), 探测、各个分段和重试都直接请求最终地址, 省去每次重定向的往返
+
+    签名地址按其中的有效期过期; 请求最终地址得到 403 或 410 时由调用方 invalidate, 再重新解析。
+    """
+
+    def __init__(self):
+        self.entries = {}  # resolve_key -> (最终地址, 过期时间戳)
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        key = resolve_key(url)
+        if key is None:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.time() >= entry[1]:
+                del self.entries[key]
+                return None
+            return entry[0]
+
+    def store(self, url, final_url):
+        key = resolve_key(url)
+        if key is None or final_url == url:
+            return
+        expiry = signed_expiry(final_url)
+        expiry = expiry - EXPIRY_MARGIN if expiry is not None else time.time() + DEFAULT_TTL
+        with self.lock:
+            self.entries[key] = (final_url, expiry)
+
+    def invalidate(self, url):
+        key = resolve_key(url)
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+redirect_cache = RedirectCache()
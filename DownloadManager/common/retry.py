@@ -0,0 +1,116 @@
+import errno
+import random
+import threading
+import time
+from collections import Counter
+
+RETRY_BASE_DELAY = 1  # 第一次重试前等待时间的上限(秒), 之后每次翻倍
+RETRY_MAX_DELAY = 60
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+DISK_ERRNOS = (errno.ENOSPC, errno.EDQUOT, errno.EROFS)  # 磁盘问题, 重试也不会好
+
+
+class DownloadStalled(TimeoutError):
+    """连接没有断开, 但速度持续低于设置的阈值"""
+
+
+class StallDetector:
+    """每个响应一个: 连续 timeout 秒的平均速度低于 min_speed(字节/秒)时判定为停滞, min_speed 为 0 时不检测
+
+    完全收不到数据的连接由读取超时处理, 这里处理的是还在缓慢收到数据、读取超时不会触发的连接。
+    feed 由读取数据的一方调用, check 可以在读取时调用, 也可以由另一个线程定期调用。
+    """
+
+    def __init__(self, min_speed, timeout):
+        self.min_speed = min_speed
+        self.timeout = timeout
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.stalled = False
+        self.message = ""
+
+    def feed(self, size):
+        self.window_bytes += size
+
+    def exclude(self, seconds):
+        # 限速等待的时间不算作连接停滞
+        self.window_start += seconds
+
+    def check(self):
+        if not self.min_speed or self.stalled:
+            return self.stalled
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed < self.timeout:
+            return False
+        if self.window_bytes < self.min_speed * elapsed:
+            self.stalled = True
+            self.message = f"download stalled ({self.window_bytes / elapsed / 1024:.1f} KB/s for {elapsed:.0f} s)"
+            return True
+        self.window_start, self.window_bytes = now, 0
+        return False
+
+
+def error_status(error):
+    """HTTP 错误的状态码, 网络错误返回 None; 兼容 requests 和 aiohttp 的异常"""
+    response = getattr(error, "response", None)
+    if response is not None and hasattr(response, "status_code"):
+        return response.status_code
+    return getattr(error, "status", None)
+
+
+def is_retryable(error):
+    if isinstance(error, OSError) and error.errno in DISK_ERRNOS:
+        return False
+    status = error_status(error)
+    # 连接错误、超时和停滞都可以重试, HTTP 错误中只有临时性的可以
+    return status is None or status in RETRYABLE_STATUS
+
+
+def backoff_delay(attempt, error=None):
+    """第 attempt 次(从 0 开始)重试前等待的秒数
+
+    服务器给出 Retry-After 时照办, 否则在按指数增长的上限内随机取值(full jitter),
+    避免多个分段和多个客户端在同一时刻一起重试。
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    retry_after = headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return min(int(retry_after), RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def retry_reason(error):
+    if isinstance(error, DownloadStalled):
+        return "stalled"
+    status = error_status(error)
+    if status is not None:
+        return f"http {status}"
+    if isinstance(error, TimeoutError):
+        return "timeout"
+    return type(error).__name__
+
+
+class RetryMetrics:
+    """进程内累计的重试次数, 按原因(stalled、timeout、http 503 等)分别计数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reasons = Counter()
+
+    def record(self, error):
+        with self.lock:
+            self.reasons[retry_reason(error)] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.reasons)
+
+    @property
+    def total(self):
+        with self.lock:
+            return sum(self.reasons.values())
+
+
+retry_metrics = RetryMetrics()
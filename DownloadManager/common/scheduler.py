@@ -0,0 +1,199 @@
+from PySide6.QtCore import QObject, QCoreApplication, QTimer, Signal
+from .config import cfg
+from .disk_space import DISK_SPACE_RESERVE, free_space, required_space
+from .installed import check_installed
+from .job import DownloadJob
+from .journal import DownloadJournal, JOURNAL_INTERVAL
+from .policy import order_jobs
+from .preflight import PreflightThread
+from .progress import DownloadProgress
+
+
+class DownloadScheduler(QObject):
+    """DownloadInterface 通过它把任务交给各个下载后端, 并把各后端的进度合并成一份"""
+    submitted = Signal(str, list)  # 后端名称, 本次接受的 DownloadJob
+    job_changed = Signal(object)  # DownloadJob
+    update_progress = Signal(object)  # 所有后端合计的 DownloadProgress
+    failed = Signal(str, str)  # 后端名称, 错误信息
+    finished = Signal(str)  # 后端名称, 该后端的任务全部结束
+    installed_checked = Signal(list, list)  # 跳过的 [(文件名, 原因)], 重新下载的 [(文件名, 原因)]
+    disk_full = Signal(list, object, object)  # 因空间不足未下载的文件名, 本批需要的字节数, 可用的字节数
+
+    def __init__(self, backends, journal=None):
+        super().__init__()
+        self.backends = {backend.name: backend for backend in backends}
+        self.progress = {}  # 后端名称 -> 最近一次的 DownloadProgress
+        self.threads = []  # 正在运行的 PreflightThread, 保留引用直到结束
+        # 任务变化先记在内存里, 每 JOURNAL_INTERVAL 秒合并写入一次日志
+        self.journal = journal or DownloadJournal()
+        self.journal_timer = QTimer(self)
+        self.journal_timer.setSingleShot(True)
+        self.journal_timer.setInterval(JOURNAL_INTERVAL * 1000)
+        self.journal_timer.timeout.connect(self.journal.flush)
+        if QCoreApplication.instance() is not None:
+            QCoreApplication.instance().aboutToQuit.connect(self.journal.flush)
+        for backend in backends:
+            backend.submitted.connect(self.backend_submitted)
+            backend.job_changed.connect(self.backend_job_changed)
+            backend.update_progress.connect(self.backend_progress)
+            backend.failed.connect(self.backend_failed)
+            backend.finished.connect(self.backend_finished)
+
+    @staticmethod
+    def create_jobs(urls, priorities=None):
+        jobs = [DownloadJob(url) for url in urls]
+        for job in jobs:
+            job.priority = (priorities or {}).get(job.url, 0)
+        return jobs
+
+    def submit(self, backend, urls, priorities=None):
+        """priorities 为 url -> 用户指定的顺序; 返回需要下载的任务, 为空时选中的模型都已安装或正在下载
+
+        任务先在后台并发 HEAD 预检, 得到实际大小后再排序、检查磁盘空间并交给后端。
+        """
+        # 预检期间选中的模型仍可点击, 已在预检或下载中的 URL 不再重复提交
+        active = self.active_urls()
+        jobs = self.filter_installed(self.create_jobs([url for url in urls if url not in active], priorities))
+        if jobs:
+            thread = PreflightThread(jobs)
+            thread.backend = backend
+            thread.pending = True
+            thread.done.connect(self.preflighted)
+            thread.finished.connect(self.thread_finished)
+            self.threads.append(thread)
+            thread.start()
+        return jobs
+
+    def preflighted(self, results):
+        thread = self.sender()
+        thread.pending = False
+        for job in thread.jobs:
+            job.preflight = results.get(job.url)
+        # 空间不足时按调度顺序接纳, 先下载的先占空间
+        jobs = self.admit(thread.backend, order_jobs(thread.jobs, cfg.get(cfg.scheduling_policy)))
+        if jobs:
+            self.backends[thread.backend].submit(jobs)
+
+    def active_urls(self):
+        """正在预检或在任一后端中尚未结束的任务的 URL"""
+        urls = {job.url for thread in self.threads if thread.pending for job in thread.jobs}
+        urls.update(job.url for job in self.status() if not job.is_final)
+        return urls
+
+    def thread_finished(self):
+        self.threads.remove(self.sender())
+
+    def filter_installed(self, jobs):
+        """去掉已安装且校验通过的模型; 文件存在但需要重新下载的报告原因"""
+        pending, skipped, redone = [], [], []
+        for job in jobs:
+            installed, reason = check_installed(job.filename)
+            if installed:
+                skipped.append((job.filename, reason))
+                continue
+            if reason is not None:
+                redone.append((job.filename, reason))
+            pending.append(job)
+        if skipped or redone:
+            self.installed_checked.emit(skipped, redone)
+        return pending
+
+    def admit(self, name, jobs):
+        """按 model_size 检查目标卷的空闲空间, 放不下时按设置裁剪或拒绝整批"""
+        backend = self.backends[name]
+        target_dir = backend.target_dir
+        # 已接受但还没下载完的任务也要占用空间, 已写入 .part 的部分不再重复计算
+        available = free_space(target_dir) - DISK_SPACE_RESERVE - sum(
+            required_space(job, target_dir) for job in backend.status() if not job.is_final
+        )
+        required = [required_space(job, target_dir) for job in jobs]
+        if sum(required) <= available:
+            return jobs
+
+        admitted, rejected = [], []
+        if cfg.get(cfg.disk_space_policy) == "trim":
+            remaining = available
+            for job, size in zip(jobs, required):
+                # 按顺序接受放得下的任务, 跳过的大文件后面的小文件仍可能放得下
+                if size <= remaining:
+                    remaining -= size
+                    admitted.append(job)
+                else:
+                    rejected.append(job)
+        else:
+            rejected = jobs
+        self.disk_full.emit([job.filename for job in rejected], sum(required), max(0, available))
+        return admitted
+
+    def pause(self, jobs=None):
+        self.dispatch("pause", jobs)
+
+    def resume(self, jobs=None):
+        self.dispatch("resume", jobs)
+
+    def cancel(self, jobs=None):
+        self.dispatch("cancel", jobs)
+
+    def set_rate_limit(self, jobs, rate):
+        """单独设置 jobs 的限速(MB/s), None 时恢复为设置中的单文件限速"""
+        for name, backend in self.backends.items():
+            selected = [job for job in jobs if job.backend == name]
+            if selected:
+                backend.set_rate_limit(selected, rate)
+        self.record(jobs)
+
+    def dispatch(self, method, jobs):
+        """按任务所属的后端分组调用, jobs 为 None 时作用于所有后端的全部任务"""
+        for name, backend in self.backends.items():
+            if jobs is None:
+                getattr(backend, method)()
+                continue
+            selected = [job for job in jobs if job.backend == name]
+            if selected:
+                getattr(backend, method)(selected)
+
+    def restore(self):
+        """把日志中上次未完成的任务交还给原来的后端, 返回这些任务"""
+        jobs = self.journal.load()
+        for name, backend in self.backends.items():
+            selected = [job for job in jobs if job.backend == name]
+            if selected:
+                backend.restore(selected)
+        return jobs
+
+    def record(self, jobs):
+        for job in jobs:
+            self.journal.record(job)
+        if not self.journal_timer.isActive():
+            self.journal_timer.start()
+
+    def status(self):
+        return [job for backend in self.backends.values() for job in backend.status()]
+
+    def is_busy(self):
+        if any(thread.pending for thread in self.threads):
+            return True
+        return any(backend.is_busy() for backend in self.backends.values())
+
+    def backend_submitted(self, jobs):
+        self.record(jobs)
+        self.submitted.emit(self.sender().name, jobs)
+
+    def backend_job_changed(self, job):
+        self.record([job])
+        self.job_changed.emit(job)
+
+    def backend_progress(self, progress):
+        backend = self.sender()
+        self.record([job for job in backend.status() if not job.is_final])
+        self.progress[backend.name] = progress
+        self.update_progress.emit(DownloadProgress.combine(self.progress.values()))
+
+    def backend_failed(self, message):
+        self.failed.emit(self.sender().name, message)
+
+    def backend_finished(self):
+        name = self.sender().name
+        # 结束的后端不再计入合计进度
+        self.progress.pop(name, None)
+        self.finished.emit(name)
@@ -0,0 +1,36 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from .config import cfg
+
+POOL_HOSTS = 10  # 保留连接池的主机数, 镜像站重定向后还会访问 CDN 主机
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """进程内共享的 requests.Session, 下载和 Aria2 RPC 都通过它复用 keep-alive 连接"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def create_session():
+    session = requests.Session()
+    # pool_block 让同一主机的并发连接数不超过 pool_maxsize, 多出的请求等待空闲连接
+    adapter = HTTPAdapter(
+        pool_connections=POOL_HOSTS,
+        pool_maxsize=cfg.get(cfg.max_connections_per_host),
+        pool_block=True
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_timeout():
+    """(连接超时, 读取超时), 单位秒"""
+    return cfg.get(cfg.connect_timeout), cfg.get(cfg.read_timeout)
@@ -3,17 +3,20 @@ from PySide6.QtCore import Qt, QEasingCurve, QUrl
 from PySide6.QtGui import QDesktopServices
 from qfluentwidgets import (
     CommandBar, FlowLayout, ScrollArea, Action, VBoxLayout, TreeWidget, ProgressBar, BodyLabel, SmoothMode,
-    InfoBar, InfoBarPosition, TitleLabel
+    InfoBar, InfoBarPosition, TitleLabel, RoundMenu
 )
 from qfluentwidgets import FluentIcon as FIF
 from huggingface_hub import hf_hub_url
-from ComfyUI.DownloadManager.common.data import ARIA2_RPC_URL, HF_ENDPOINT, ARIA2_RPC_SECRET, models_info
-from ComfyUI.DownloadManager.common.download_thread import DownloadThread
+from ComfyUI.DownloadManager.common.data import HF_ENDPOINT, models_info
+from ComfyUI.DownloadManager.common.backends import DirectBackend, Aria2Backend
+from ComfyUI.DownloadManager.common.retry import retry_metrics
+from ComfyUI.DownloadManager.common.scheduler import DownloadScheduler
 from ComfyUI.DownloadManager.widgets.tag_widget import TagWidget
-import requests
-import json
 import os
 
+RATE_LIMIT_PRESETS = [1, 2, 5, 10, 20, 50]  # 右键菜单中可选的单任务限速(MB/s)
+
+
 class DownloadInterface(QFrame):
     def __init__(self, parent = None):
         super().__init__(parent)
@@ -25,11 +28,24 @@ class DownloadInterface(QFrame):
             "VR_Models": []
         }
         self.model_urls = []
+        self.model_priorities = {}
         self.total_progress = 0
         self.total_files = 0
         self.download_speed = 0
         self.total_downloaded = 0
+        self.scheduler = DownloadScheduler([
+            DirectBackend("./pretrain"),
+            Aria2Backend(os.path.join(os.getcwd(), "pretrain"))
+        ])
+        self.scheduler.submitted.connect(self.download_submitted)
+        self.scheduler.job_changed.connect(self.job_changed)
+        self.scheduler.update_progress.connect(self.update_download_progress)
+        self.scheduler.failed.connect(self.download_failed)
+        self.scheduler.finished.connect(self.download_finished)
+        self.scheduler.installed_checked.connect(self.installed_checked)
+        self.scheduler.disk_full.connect(self.disk_full)
         self.setupUI()
+        self.restore_downloads()
 
     def setupUI(self):
         self.command_bar = CommandBar(self)
@@ -59,7 +75,9 @@ class DownloadInterface(QFrame):
         self.command_bar.addSeparator()
         self.command_bar.addAction(Action(FIF.FOLDER, self.tr("Open Folder"), triggered=self.openFolder))
         self.command_bar.addAction(Action(FIF.DOWNLOAD, self.tr("Download Model(s)"), triggered=self.download_all_models))
-        # self.command_bar.addAction(Action(FIF.CANCEL, '取消下载', triggered=self.download_thread.terminate))
+        self.command_bar.addAction(Action(FIF.PAUSE, self.tr("Pause"), triggered=self.pause_downloads))
+        self.command_bar.addAction(Action(FIF.PLAY, self.tr("Resume"), triggered=self.resume_downloads))
+        self.command_bar.addAction(Action(FIF.CANCEL, self.tr("Cancel Download"), triggered=self.cancel_downloads))
         self.command_bar.addAction(Action(FIF.SEND, self.tr("Send To Aria2"), triggered=self.send_to_aria2))
         self.command_bar.addAction(Action(FIF.DELETE, self.tr("clear"), triggered=self.clearModels))
         self.command_bar.setToolButtonStyle(Qt.ToolButtonTextBesideIcon)
@@ -79,6 +97,8 @@ class DownloadInterface(QFrame):
         # self.layout.setStretch(2, 1)          
 
         self.tree.itemChanged.connect(self.treeItemChanged)
+        self.tree.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.tree.customContextMenuRequested.connect(self.showTreeMenu)
 
         self.total_progress_bar = ProgressBar(self)
 
@@ -199,6 +219,7 @@ class DownloadInterface(QFrame):
     def addButtonToLayout(self, model_name):
         tag_widget = TagWidget(model_name)
         tag_widget.deleteSignal.connect(self.removeTagFromLayout)
+        tag_widget.raiseSignal.connect(self.raiseTag)
         self.flow_layout.addWidget(tag_widget)
 
     def removeButtonFromLayout(self, model_name):
@@ -210,6 +231,21 @@ class DownloadInterface(QFrame):
                 break
         self.flow_layout.update()    
 
+    def raiseTag(self, model_name):
+        # 标签栏的顺序即"priority"调度策略下的下载顺序
+        for i in range(self.flow_layout.count()):
+            widget = self.flow_layout.itemAt(i).widget()
+            if isinstance(widget, TagWidget) and widget.text == model_name:
+                self.flow_layout.removeWidget(widget)
+                # 仍挂在原父控件下时 insertWidget 会再次从布局中移除它
+                widget.setParent(None)
+                self.flow_layout.insertWidget(0, widget)
+                break
+        self.flow_layout.update()
+
+    def tag_order(self):
+        return [self.flow_layout.itemAt(i).widget().text for i in range(self.flow_layout.count())]
+
     def removeTagFromLayout(self, model_name):
         for item in [self.tree.topLevelItem(i) for i in range(self.tree.topLevelItemCount())]:
             for child_item in [item.child(i) for i in range(item.childCount())]:
@@ -219,11 +255,14 @@ class DownloadInterface(QFrame):
 
     def generate_urls(self):
         self.model_urls.clear()
+        self.model_priorities = {}
+        tags = self.tag_order()
 
         for category, models in self.model_to_download.items():
             for model in models:
                 url = hf_hub_url(repo_id="Sucial/MSST-WebUI", filename=f"All_Models/{category}/{model}", endpoint=HF_ENDPOINT)
                 self.model_urls.append(url)
+                self.model_priorities[url] = tags.index(model) if model in tags else len(tags)
                 self.total_files += 1
 
     def download_all_models(self):
@@ -236,93 +275,188 @@ class DownloadInterface(QFrame):
                      duration=5000,
                      parent=self)
             return
+        if not self.scheduler.submit("direct", self.model_urls, self.model_priorities):
+            # 选中的模型都已安装或正在下载
+            self.clearModels()
+            return
         InfoBar.info(title="INFO",
                      content=self.tr("Downloading models, Please do not click repeatedly..."), 
                      isClosable=True,
                      position=InfoBarPosition.TOP,
                      duration=5000,
                      parent=self)
+        self.prepare_progress()
+
+    def send_to_aria2(self):
+        self.generate_urls()
+        if not self.model_urls:
+            InfoBar.error(title="ERROR",
+                     content=self.tr("Please select models to download first!"), 
+                     isClosable=True,
+                     position=InfoBarPosition.TOP,
+                     duration=5000,
+                     parent=self)
+            return
+        if not self.scheduler.submit("aria2", self.model_urls, self.model_priorities):
+            self.clearModels()
+
+    def restore_downloads(self):
+        # 上次退出或崩溃时未完成的任务自动继续
+        jobs = self.scheduler.restore()
+        if not jobs:
+            return
+        self.prepare_progress()
+        InfoBar.info(title="INFO",
+                     content=self.tr(f"Resuming {len(jobs)} unfinished download task(s) from the last session."),
+                     isClosable=True,
+                     position=InfoBarPosition.TOP,
+                     duration=5000,
+                     parent=self)
+
+    def prepare_progress(self):
         self.total_progress_bar.setValue(0)
-        self.single_progress_bar.setValue(0) 
+        self.single_progress_bar.setValue(0)
         self.download_speed_label.setText(self.tr("Preparing to download..."))
-        target_dir = "./pretrain"
         self.total_progress = 0
 
-        # 启动下载线程
-        self.download_thread = DownloadThread(self.model_urls, target_dir)
-        self.download_thread.update_single_progress.connect(self.single_progress_bar.setValue)
-        self.download_thread.update_total_progress.connect(self.total_progress_bar.setValue)
-        self.download_thread.update_speed.connect(self.update_download_speed)
-        self.download_thread.start()
-        self.download_thread.finished.connect(self.download_finished)
+    def update_download_progress(self, progress):
+        # 所有后端的进度由调度器合并成一个 DownloadProgress
+        if progress.total_size:
+            self.single_progress_bar.setValue(progress.percent)
+        self.total_progress_bar.setValue(progress.batch_percent)
+        if not progress.active:
+            return
+        speed = f"{progress.speed / 1024 / 1024:.2f} MB/s"
+        eta = self.format_eta(progress.eta)
+        batch_eta = self.format_eta(progress.batch_eta)
+        text = self.tr(f"Download speed: {speed}, current: {eta}, total: {batch_eta} remaining")
+        if progress.retries:
+            text += self.tr(f", {progress.retries} retries")
+            # 悬停时按原因列出本次运行以来的重试次数
+            reasons = ", ".join(f"{reason}: {count}" for reason, count in sorted(retry_metrics.snapshot().items()))
+            self.download_speed_label.setToolTip(self.tr(f"Retries since start: {reasons}"))
+        self.download_speed_label.setText(text)
+
+    @staticmethod
+    def format_eta(seconds):
+        if seconds is None:
+            return "--:--"
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+    def installed_checked(self, skipped, redone):
+        messages = []
+        if skipped:
+            messages.append(self.tr(f"Skipped {len(skipped)} installed model(s): ") + "; ".join(
+                f"{filename} ({reason})" for filename, reason in skipped))
+        if redone:
+            messages.append(self.tr(f"Downloading {len(redone)} model(s) again: ") + "; ".join(
+                f"{filename} ({reason})" for filename, reason in redone))
+        InfoBar.info(title="INFO",
+                     content="\n".join(messages),
+                     isClosable=True,
+                     position=InfoBarPosition.TOP,
+                     duration=10000,
+                     parent=self)
+
+    def disk_full(self, filenames, required, available):
+        required = f"{required / 1024 ** 3:.2f} GB"
+        available = f"{available / 1024 ** 3:.2f} GB"
+        InfoBar.error(title="ERROR",
+                     content=self.tr(f"Not enough disk space: {required} needed, {available} available. Not downloaded: ") + "; ".join(filenames),
+                     isClosable=True,
+                     position=InfoBarPosition.TOP,
+                     duration=-1,
+                     parent=self)
 
-    def update_download_speed(self, speed):
-        # print(f"当前下载速度: {speed}")
-        self.download_speed_label.setText(self.tr(f"Download speed: {speed}"))   
+    def download_submitted(self, backend, jobs):
+        errors = [f"{job.filename}: {job.error}" for job in jobs if job.status == "error"]
+        if errors:
+            InfoBar.error(title="ERROR",
+                     content=self.tr(f"{len(jobs) - len(errors)} task(s) submitted, {len(errors)} failed: ") + "; ".join(errors), 
+                     isClosable=True,
+                     position=InfoBarPosition.TOP,
+                     duration=-1,
+                     parent=self)
+            return
 
-    def download_finished(self):
-        self.download_speed_label.setText(self.tr("Download task completed!"))    
-        InfoBar.success(title="SUCCESS",
-                     content=self.tr("Download task completed!"), 
+        if backend == "aria2":
+            InfoBar.success(title="SUCCESS",
+                     content=self.tr(f"{len(jobs)} download task(s) have been submitted to Aria2."), 
                      isClosable=True,
                      position=InfoBarPosition.TOP,
                      duration=5000,
                      parent=self)
+            self.prepare_progress()
         self.clearModels()
 
-    def send_to_aria2(self):
-        self.generate_urls()
-        
-        download_dir = os.path.join(os.getcwd(), "pretrain")
-        flag = True
-
-        for url in self.model_urls:
-            model_filename = url.split("/")[-1]
-            category = url.split("/")[-2]
-
-            target_path = f"{download_dir}/{category}"
-            json_rpc_data = {
-                "jsonrpc": "2.0",
-                "method": "aria2.addUri",
-                "id": 1,
-                "params": [
-                    f"token:{ARIA2_RPC_SECRET}",
-                    [url],
-                    {"dir": target_path, "out": model_filename}
-                ]
-            }
-
-            try:
-                response = requests.post(ARIA2_RPC_URL, data=json.dumps(json_rpc_data))
-            except requests.exceptions.ConnectionError as e:
-                InfoBar.error(title="ERROR",
-                        content=self.tr(f"Failed to connect to Aria2 RPC: {e}. Please check if the Aria2 service is running."),
-                        isClosable=True,
-                        position=InfoBarPosition.TOP,
-                        duration=-1,
-                        parent=self)
-                flag = False
-
-            if response.status_code == 200:
-                InfoBar.success(title="SUCCESS",
-                     content=self.tr("The download task(s) has been submitted to Aria2."), 
+    def job_changed(self, job):
+        if job.status == "paused":
+            if not any(job.status == "active" for job in self.scheduler.status()):
+                self.download_speed_label.setText(self.tr("Download paused"))
+            return
+        if job.status != "error":
+            return
+        InfoBar.error(title="ERROR",
+                     content=self.tr(f"Download of {job.filename} failed: {job.error}"),
                      isClosable=True,
                      position=InfoBarPosition.TOP,
-                     duration=5000,
+                     duration=-1,
                      parent=self)
-                
-            else:
-                InfoBar.error(title="ERROR",
-                     content=self.tr(f"Failed to submit the task, error message: {response.text}"), 
+
+    def download_failed(self, backend, message):
+        if backend == "aria2":
+            message = self.tr(f"{message}. Please check if the Aria2 service is running.")
+        InfoBar.error(title="ERROR",
+                     content=message,
+                     isClosable=True,
+                     position=InfoBarPosition.TOP,
+                     duration=-1,
+                     parent=self)
+
+    def download_finished(self, backend):
+        if self.scheduler.is_busy():
+            return
+        self.download_speed_label.setText(self.tr("Download task completed!"))    
+        InfoBar.success(title="SUCCESS",
+                     content=self.tr("Download task completed!"), 
                      isClosable=True,
                      position=InfoBarPosition.TOP,
                      duration=5000,
                      parent=self)
-                flag = False
 
-        if flag:    
-            self.clearModels()
-                    
+    def showTreeMenu(self, pos):
+        # 右键单个模型可以暂停、继续或取消它的下载任务
+        item = self.tree.itemAt(pos)
+        if item is None or item.parent() is None:
+            return
+        jobs = [job for job in self.scheduler.status() if job.filename == item.text(0) and not job.is_final]
+        if not jobs:
+            return
+        menu = RoundMenu(parent=self)
+        menu.addAction(Action(FIF.PAUSE, self.tr("Pause"), triggered=lambda: self.scheduler.pause(jobs)))
+        menu.addAction(Action(FIF.PLAY, self.tr("Resume"), triggered=lambda: self.scheduler.resume(jobs)))
+        menu.addAction(Action(FIF.CANCEL, self.tr("Cancel Download"), triggered=lambda: self.scheduler.cancel(jobs)))
+        # 单独限速, 代替设置中的单文件限速, 正在下载时立即生效
+        limit_menu = RoundMenu(self.tr("Speed Limit"), self)
+        limit_menu.setIcon(FIF.SPEED_MEDIUM)
+        limit_menu.addAction(Action(self.tr("Default"), triggered=lambda: self.scheduler.set_rate_limit(jobs, None)))
+        limit_menu.addAction(Action(self.tr("Unlimited"), triggered=lambda: self.scheduler.set_rate_limit(jobs, 0)))
+        for rate in RATE_LIMIT_PRESETS:
+            limit_menu.addAction(Action(f"{rate} MB/s", triggered=lambda checked=False, rate=rate: self.scheduler.set_rate_limit(jobs, rate)))
+        menu.addMenu(limit_menu)
+        menu.exec(self.tree.viewport().mapToGlobal(pos))
+
+    def pause_downloads(self):
+        self.scheduler.pause()
+
+    def resume_downloads(self):
+        self.scheduler.resume()
+
+    def cancel_downloads(self):
+        self.scheduler.cancel()
+
     def clearModels(self):
         
         for i in range(self.tree.topLevelItemCount()):
@@ -6,6 +6,7 @@ from PySide6.QtCore import Qt
 from qfluentwidgets import  (ScrollArea, InfoBar, InfoBarPosition, TableWidget, CheckBox, PushButton, IndeterminateProgressRing, Dialog, TitleLabel, CommandBar, Action)
 from qfluentwidgets import FluentIcon as FIF
 from ComfyUI.DownloadManager.common.data import models_info
+from ComfyUI.DownloadManager.common.installed import fingerprints, is_complete
 
 
 class ManagerInterface(QFrame):
@@ -75,7 +76,7 @@ class ManagerInterface(QFrame):
 
             # is_installed = row['is_installed']
             checkbox = CheckBox()
-            is_installed = os.path.exists(row['target_position'])
+            is_installed = is_complete(row['target_position'])
             if self.table_data[model]['is_installed'] != is_installed:
                 self.table_data[model]['is_installed'] = is_installed
                 dump = True
@@ -158,6 +159,8 @@ class ManagerInterface(QFrame):
 
         hash = self.calculate_sha256(file_path)
         if hash == sha256:
+            # 记录校验结果, 下载时据此跳过这个模型
+            fingerprints.record(file_path, hash)
             InfoBar.success(
                 title=self.tr("Hash Check Passed"),
                 content=self.tr("Hash match"),
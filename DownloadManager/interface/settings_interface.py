@@ -3,6 +3,7 @@ from PySide6.QtCore import Qt
 from PySide6.QtGui import QIntValidator
 from qfluentwidgets import (setTheme, ScrollArea, setThemeColor, SettingCardGroup, OptionsSettingCard, PasswordLineEdit,
                             CustomColorSettingCard, SettingCard, InfoBar, LineEdit, TitleLabel, ComboBoxSettingCard,
+                            RangeSettingCard, SwitchSettingCard,
                             )
 from qfluentwidgets import FluentIcon as FIF
 from ComfyUI.DownloadManager.common.config import cfg
@@ -35,10 +36,23 @@ class SettingsInterface(QFrame):
         # self.scroll_area.setViewportMargins(0, 80, 0, 20)
         
         self.personalGroup.addSettingCards([self.themeCard, self.themeColorCard, self.languageCard])
-        self.settingGroup.addSettingCards([self.aria2Card, self.aria2SecretCard, self.hfEndpointCard])
+        self.settingGroup.addSettingCards([
+            self.aria2Card, self.aria2SecretCard, self.hfEndpointCard, self.hfEndpointsCard, self.autoMirrorCard
+        ])
+        self.aria2Group.addSettingCards([
+            self.aria2SplitCard, self.aria2MaxConnectionCard, self.aria2MinSplitSizeCard, self.aria2FileAllocationCard
+        ])
+        self.downloadGroup.addSettingCards([
+            self.engineCard, self.schedulingCard, self.diskSpaceCard, self.segmentsCard, self.concurrentFilesCard,
+            self.mirrorRaceCard, self.maxConnectionsCard, self.connectTimeoutCard, self.readTimeoutCard,
+            self.rateLimitCard, self.fileRateLimitCard, self.fsyncCard,
+            self.retryAttemptsCard, self.stallSpeedCard, self.stallTimeoutCard
+        ])
 
         self.cardsLayout.addWidget(self.personalGroup)
         self.cardsLayout.addWidget(self.settingGroup)
+        self.cardsLayout.addWidget(self.downloadGroup)
+        self.cardsLayout.addWidget(self.aria2Group)
 
         self.layout.addWidget(self.scroll_area)
         self.setLayout(self.layout)
@@ -120,11 +134,180 @@ class SettingsInterface(QFrame):
         # hf_endpoint_line_edit.textChanged.connect(self.setHfEndpoint)
         hf_endpoint_line_edit.editingFinished.connect(lambda: self.setHfEndpoint(hf_endpoint_line_edit.text()))
 
+        self.hfEndpointsCard = SettingCard(
+            FIF.GLOBE,
+            self.tr("Mirror endpoints"),
+            self.tr("Candidate Hugging Face endpoints, separated by commas"),
+            self.settingGroup
+        )
+        hf_endpoints_line_edit = LineEdit()
+        hf_endpoints_line_edit.setText(", ".join(cfg.get(cfg.hf_endpoints)))
+        hf_endpoints_line_edit.setMinimumWidth(300)
+        self.hfEndpointsCard.hBoxLayout.addWidget(hf_endpoints_line_edit)
+        self.hfEndpointsCard.hBoxLayout.addSpacerItem(QSpacerItem(20, 20))
+        hf_endpoints_line_edit.editingFinished.connect(lambda: self.setHfEndpoints(hf_endpoints_line_edit.text()))
+
+        self.autoMirrorCard = SwitchSettingCard(
+            FIF.SPEED_MEDIUM,
+            self.tr("Auto select mirror"),
+            self.tr("Probe the mirror endpoints before downloading and use the fastest one"),
+            configItem=cfg.auto_select_mirror,
+            parent=self.settingGroup
+        )
+
+        self.downloadGroup = SettingCardGroup(
+            self.tr("Download"), self.widget)
+        self.engineCard = ComboBoxSettingCard(
+            cfg.download_engine,
+            FIF.DEVELOPER_TOOLS,
+            self.tr("Download engine"),
+            self.tr("The asyncio engine needs aiohttp and uses far fewer threads for many files"),
+            texts=["threaded", "asyncio"],
+            parent=self.downloadGroup
+        )
+        self.schedulingCard = ComboBoxSettingCard(
+            cfg.scheduling_policy,
+            FIF.SCROLL,
+            self.tr("Scheduling policy"),
+            self.tr("selection: category order, shortest: small files first, priority: tag order, fair: categories take turns"),
+            texts=["selection", "shortest", "priority", "fair"],
+            parent=self.downloadGroup
+        )
+        self.diskSpaceCard = ComboBoxSettingCard(
+            cfg.disk_space_policy,
+            FIF.SAVE,
+            self.tr("When disk space is insufficient"),
+            self.tr("trim: download only the models that fit, reject: download nothing"),
+            texts=["trim", "reject"],
+            parent=self.downloadGroup
+        )
+        self.segmentsCard = RangeSettingCard(
+            cfg.download_segments,
+            FIF.SPEED_HIGH,
+            self.tr("Connections per file"),
+            self.tr("Split each file into byte ranges fetched in parallel"),
+            parent=self.downloadGroup
+        )
+        self.concurrentFilesCard = RangeSettingCard(
+            cfg.concurrent_files,
+            FIF.DOWNLOAD,
+            self.tr("Concurrent downloads"),
+            self.tr("Number of files downloaded at the same time"),
+            parent=self.downloadGroup
+        )
+        self.mirrorRaceCard = RangeSettingCard(
+            cfg.mirror_race_min_size,
+            FIF.GLOBE,
+            self.tr("Multi-mirror threshold (MiB)"),
+            self.tr("Files at least this large fetch their segments from several mirrors at once"),
+            parent=self.downloadGroup
+        )
+        self.maxConnectionsCard = RangeSettingCard(
+            cfg.max_connections_per_host,
+            FIF.CONNECT,
+            self.tr("Connections per host"),
+            self.tr("Maximum number of pooled keep-alive connections to one server"),
+            parent=self.downloadGroup
+        )
+        self.connectTimeoutCard = RangeSettingCard(
+            cfg.connect_timeout,
+            FIF.STOP_WATCH,
+            self.tr("Connect timeout"),
+            self.tr("Seconds to wait for a connection to be established"),
+            parent=self.downloadGroup
+        )
+        self.readTimeoutCard = RangeSettingCard(
+            cfg.read_timeout,
+            FIF.HISTORY,
+            self.tr("Read timeout"),
+            self.tr("Seconds to wait for data from the server"),
+            parent=self.downloadGroup
+        )
+        self.rateLimitCard = RangeSettingCard(
+            cfg.rate_limit,
+            FIF.SPEED_MEDIUM,
+            self.tr("Bandwidth limit (MB/s)"),
+            self.tr("Total download speed of all files, 0 for unlimited; takes effect immediately"),
+            parent=self.downloadGroup
+        )
+        self.fileRateLimitCard = RangeSettingCard(
+            cfg.file_rate_limit,
+            FIF.SPEED_MEDIUM,
+            self.tr("Per-file bandwidth limit (MB/s)"),
+            self.tr("Download speed of each file, 0 for unlimited; takes effect immediately"),
+            parent=self.downloadGroup
+        )
+        self.fsyncCard = ComboBoxSettingCard(
+            cfg.fsync_policy,
+            FIF.SAVE_AS,
+            self.tr("Write to disk"),
+            self.tr("none: leave it to the OS, end: flush each file before renaming it, periodic: also flush before saving progress"),
+            texts=["none", "end", "periodic"],
+            parent=self.downloadGroup
+        )
+        self.retryAttemptsCard = RangeSettingCard(
+            cfg.retry_attempts,
+            FIF.SYNC,
+            self.tr("Retry attempts"),
+            self.tr("Times to retry a failed segment, with randomized exponential backoff"),
+            parent=self.downloadGroup
+        )
+        self.stallSpeedCard = RangeSettingCard(
+            cfg.stall_speed,
+            FIF.SPEED_OFF,
+            self.tr("Stall speed (KB/s)"),
+            self.tr("Reconnect when a connection stays below this speed, 0 to disable"),
+            parent=self.downloadGroup
+        )
+        self.stallTimeoutCard = RangeSettingCard(
+            cfg.stall_timeout,
+            FIF.STOP_WATCH,
+            self.tr("Stall timeout"),
+            self.tr("Seconds a connection may stay below the stall speed"),
+            parent=self.downloadGroup
+        )
+
+        self.aria2Group = SettingCardGroup(
+            self.tr("Aria2 Download"), self.widget)
+        self.aria2SplitCard = RangeSettingCard(
+            cfg.aria2_split,
+            FIF.SPEED_HIGH,
+            self.tr("Split"),
+            self.tr("Number of connections Aria2 uses to download one file"),
+            parent=self.aria2Group
+        )
+        self.aria2MaxConnectionCard = RangeSettingCard(
+            cfg.aria2_max_connection_per_server,
+            FIF.CONNECT,
+            self.tr("Max connections per server"),
+            self.tr("Maximum number of Aria2 connections to one server for each file"),
+            parent=self.aria2Group
+        )
+        self.aria2MinSplitSizeCard = RangeSettingCard(
+            cfg.aria2_min_split_size,
+            FIF.TILES,
+            self.tr("Min split size (MiB)"),
+            self.tr("Aria2 does not split ranges smaller than this"),
+            parent=self.aria2Group
+        )
+        self.aria2FileAllocationCard = ComboBoxSettingCard(
+            cfg.aria2_file_allocation,
+            FIF.SAVE,
+            self.tr("File allocation"),
+            self.tr("How Aria2 reserves disk space before downloading"),
+            texts=["none", "prealloc", "trunc", "falloc"],
+            parent=self.aria2Group
+        )
+
         self.connectSignalToSlot()    
 
     def setHfEndpoint(self, endpoint):
         cfg.set(cfg.hf_endpoint, endpoint)
 
+    def setHfEndpoints(self, endpoints):
+        endpoints = [endpoint.strip() for endpoint in endpoints.split(",") if endpoint.strip()]
+        cfg.set(cfg.hf_endpoints, endpoints)
+
     def setAria2Port(self, port):
         port = int(port)
         cfg.set(cfg.aria2_port, port)
@@ -0,0 +1,276 @@
+"""
+下载引擎的微基准测试, 在项目根目录运行:
+    python ./ComfyUI/DownloadManager/utils/bench_download.py --size 512
+
+本地起一个支持 Range 的 HTTP 服务器(独立进程, 不计入 CPU 时间), 对比旧的 1 KiB iter_content 循环
+和 DownloadThread 的 readinto 路径, 输出吞吐量(MB/s)和每 GB 消耗的 CPU 秒数。
+DownloadThread 的结果包含边下载边计算 sha256 的开销, 旧写法没有。
+
+--race 时另起两个限速不同的服务器作为两个镜像, 对比只用其中一个和同时使用两个的耗时。
+
+--concurrency N 时同时下载 N 个 --size MiB 的文件, 对比线程引擎和 asyncio 引擎的吞吐量、CPU 时间和峰值线程数:
+    python ./ComfyUI/DownloadManager/utils/bench_download.py --size 4 --concurrency 128 --rate 1
+
+--policies N 时下载 N 个大小不一(--size 的 1/16 到 1 倍)、分属三个分类的文件, 同时只下载 --workers 个,
+对比各调度策略下模型可用的平均时间(每个文件下载完成的时刻取平均)和全部完成的时间:
+    python ./ComfyUI/DownloadManager/utils/bench_download.py --size 64 --policies 12 --workers 2 --rate 20
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+sys.path.append(os.getcwd())
+
+import requests
+
+BLOCK = os.urandom(1024 * 1024)
+
+
+class BenchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    file_size = 0
+    file_sizes = {}  # 路径 -> 文件大小, 不在其中的路径用 file_size
+    rate = 0  # 每个连接的限速(字节/秒), 0 为不限速
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        file_size = self.file_sizes.get(self.path, self.file_size)
+        start, end = 0, file_size - 1
+        range_header = self.headers.get("Range")
+        if range_header:
+            first, last = range_header.split("=", 1)[1].split("-", 1)
+            start = int(first)
+            end = min(int(last), end) if last else end
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{file_size}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        position = start
+        view = memoryview(BLOCK)
+        try:
+            while position <= end:
+                offset = position % len(BLOCK)
+                size = min(len(BLOCK) - offset, end - position + 1)
+                self.wfile.write(view[offset:offset + size])
+                position += size
+                if self.rate:
+                    time.sleep(size / self.rate)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class BenchServer(ThreadingHTTPServer):
+    request_queue_size = 1024  # 默认的 listen 队列只有 5, 大量并发连接会因 SYN 重传而变慢
+
+
+def serve(port, file_size, rate, file_sizes=None):
+    handler = type("Handler", (BenchHandler,), {"file_size": file_size, "rate": rate, "file_sizes": file_sizes or {}})
+    BenchServer(("127.0.0.1", port), handler).serve_forever()
+
+
+def start_server(port, file_size, rate=0, file_sizes=None):
+    process = multiprocessing.Process(target=serve, args=(port, file_size, rate, file_sizes), daemon=True)
+    process.start()
+    for _ in range(50):
+        try:
+            requests.get(f"http://127.0.0.1:{port}/", headers={"Range": "bytes=0-0"}).close()
+            return process
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError("benchmark server did not start")
+
+
+def legacy_download(url, target_dir):
+    """改动前 download_model 的写法: 每 1 KiB 一次迭代"""
+    os.makedirs(os.path.join(target_dir, "bench"), exist_ok=True)
+    response = requests.get(url, stream=True)
+    with open(os.path.join(target_dir, "bench", "model.bin"), 'wb') as f:
+        for chunk in response.iter_content(chunk_size=1024):
+            if chunk:
+                f.write(chunk)
+
+
+def engine_download(url, target_dir, segments, endpoints=None):
+    from ComfyUI.DownloadManager.common import download_thread
+    from ComfyUI.DownloadManager.common.mirrors import MirrorSelector
+
+    if endpoints:
+        download_thread.mirror_selector = MirrorSelector(endpoints)
+        download_thread.mirror_selector.probe(url)
+    thread = download_thread.DownloadThread([url], target_dir)
+    thread.segments = segments
+    thread.run()
+
+
+def engine_download_many(urls, target_dir, engine):
+    from ComfyUI.DownloadManager.common.download_thread import DownloadThread
+    from ComfyUI.DownloadManager.common.async_engine import AsyncDownloadThread
+
+    thread = (AsyncDownloadThread if engine == "asyncio" else DownloadThread)(urls, target_dir)
+    thread.segments = 1
+    thread.max_workers = len(urls)
+    thread.run()
+
+
+def peak_threads(func):
+    """运行 func 并返回期间的最大线程数"""
+    peak = [threading.active_count()]
+    stopped = threading.Event()
+
+    def sample():
+        while not stopped.wait(0.01):
+            peak[0] = max(peak[0], threading.active_count())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        func()
+    finally:
+        stopped.set()
+        sampler.join()
+    # 不计采样线程本身
+    return peak[0] - 1
+
+
+def measure(name, func, file_size):
+    target_dir = tempfile.mkdtemp(prefix="bench_download_")
+    try:
+        wall, cpu = time.perf_counter(), time.process_time()
+        func(target_dir)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    finally:
+        shutil.rmtree(target_dir, ignore_errors=True)
+    gigabytes = file_size / 1024 ** 3
+    print(f"{name:<24}{file_size / wall / 1024 ** 2:>10.1f} MB/s{cpu / gigabytes:>10.2f} CPU s/GB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download engine micro-benchmark")
+    parser.add_argument("--size", type=int, default=512, help="file size in MiB")
+    parser.add_argument("--port", type=int, default=18765)
+    parser.add_argument("--segments", type=int, default=4)
+    parser.add_argument("--race", action="store_true", help="compare one mirror against two rate-limited mirrors")
+    parser.add_argument("--rates", type=float, nargs=2, default=[5, 20], help="per-connection MB/s of the two mirrors")
+    parser.add_argument("--concurrency", type=int, default=0, help="compare the threaded and asyncio engines on this many files")
+    parser.add_argument("--rate", type=float, default=0, help="per-connection MB/s in --concurrency and --policies mode, 0 for unlimited")
+    parser.add_argument("--policies", type=int, default=0, help="compare the scheduling policies on this many files of mixed sizes")
+    parser.add_argument("--workers", type=int, default=2, help="files downloaded at the same time in --policies mode")
+    args = parser.parse_args()
+
+    file_size = args.size * 1024 * 1024
+    if args.race:
+        bench_race(args, file_size)
+        return
+    if args.concurrency:
+        bench_concurrency(args, file_size)
+        return
+    if args.policies:
+        bench_policies(args, file_size)
+        return
+
+    server = start_server(args.port, file_size)
+    url = f"http://127.0.0.1:{args.port}/bench/model.bin"
+    try:
+        measure("iter_content 1 KiB", lambda target_dir: legacy_download(url, target_dir), file_size)
+        measure("readinto", lambda target_dir: engine_download(url, target_dir, 1), file_size)
+        measure(f"readinto x{args.segments}", lambda target_dir: engine_download(url, target_dir, args.segments), file_size)
+    finally:
+        server.terminate()
+
+
+def bench_race(args, file_size):
+    from ComfyUI.DownloadManager.common.config import cfg
+
+    cfg.mirror_race_min_size.value = 0
+    ports = [args.port + 1, args.port + 2]
+    servers = [start_server(port, file_size, rate * 1024 * 1024) for port, rate in zip(ports, args.rates)]
+    endpoints = [f"http://127.0.0.1:{port}" for port in ports]
+    path = "/bench/model.bin"
+    try:
+        for endpoint, rate in zip(endpoints, args.rates):
+            measure(f"{rate:g} MB/s mirror only", lambda target_dir: engine_download(
+                endpoint + path, target_dir, args.segments, [endpoint]), file_size)
+        measure("both mirrors", lambda target_dir: engine_download(
+            endpoints[0] + path, target_dir, args.segments, endpoints), file_size)
+    finally:
+        for server in servers:
+            server.terminate()
+
+
+def bench_concurrency(args, file_size):
+    from ComfyUI.DownloadManager.common.config import cfg
+
+    cfg.auto_select_mirror.value = False
+    cfg.max_connections_per_host.value = args.concurrency
+    server = start_server(args.port, file_size, args.rate * 1024 * 1024)
+    urls = [f"http://127.0.0.1:{args.port}/bench/model{i}.bin" for i in range(args.concurrency)]
+    try:
+        for engine in ("threaded", "asyncio"):
+            peak = []
+            measure(f"{engine} x{args.concurrency}", lambda target_dir: peak.append(
+                peak_threads(lambda: engine_download_many(urls, target_dir, engine))), file_size * len(urls))
+            print(f"{'':<24}{peak[0]:>10} threads")
+    finally:
+        server.terminate()
+
+
+def bench_policies(args, file_size):
+    from PySide6.QtCore import Qt
+    from ComfyUI.DownloadManager.common.config import cfg
+    from ComfyUI.DownloadManager.common.data import models_info
+    from ComfyUI.DownloadManager.common.download_thread import DownloadThread
+    from ComfyUI.DownloadManager.common.job import DownloadJob
+    from ComfyUI.DownloadManager.common.policy import SCHEDULING_POLICIES, PRIORITY, order_jobs
+
+    cfg.auto_select_mirror.value = False
+    categories = ["multi_stem_models", "single_stem_models", "vocal_models"]
+    # 大文件排在选择顺序的前面, 与按分类选择大模型在前时的情形一致
+    scales = [16, 1, 8, 2, 4, 1]
+    file_sizes = {}
+    urls = []
+    for i in range(args.policies):
+        path = f"/{categories[i % len(categories)]}/bench{i}.bin"
+        file_sizes[path] = file_size * scales[i % len(scales)] // 16
+        urls.append(f"http://127.0.0.1:{args.port}{path}")
+    server = start_server(args.port, file_size, args.rate * 1024 * 1024, file_sizes)
+    for url, path in zip(urls, file_sizes):
+        # 调度策略按 models_info 中的 model_size 排序
+        models_info[url.split("/")[-1]] = {"model_size": file_sizes[path]}
+
+    try:
+        for policy in SCHEDULING_POLICIES:
+            if policy == PRIORITY:
+                # 取决于用户在标签栏中排的顺序, 没有代表性的测试数据
+                continue
+            jobs = order_jobs([DownloadJob(url) for url in urls], policy)
+            target_dir = tempfile.mkdtemp(prefix="bench_download_")
+            finished = []
+            try:
+                thread = DownloadThread([job.url for job in jobs], target_dir)
+                thread.segments = 1
+                thread.max_workers = args.workers
+                # 信号在下载线程池中发出, 没有事件循环, 直接调用
+                thread.download_complete.connect(lambda url: finished.append(time.perf_counter()), Qt.DirectConnection)
+                start = time.perf_counter()
+                thread.run()
+            finally:
+                shutil.rmtree(target_dir, ignore_errors=True)
+            times = [t - start for t in finished]
+            print(f"{policy:<24}{sum(times) / len(times):>8.2f} s mean{max(times):>8.2f} s total")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
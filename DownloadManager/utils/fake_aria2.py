@@ -0,0 +1,244 @@
+"""
+本地模拟的 aria2 JSON-RPC 服务器, 在没有 aria2 的环境里检查 Aria2Monitor, 在项目根目录运行:
+    python ./ComfyUI/DownloadManager/utils/fake_aria2.py --files 4 --size 64 --rate 16
+
+服务器支持 aria2.addUri、tellStatus、pause、unpause、remove、changeOption、changeGlobalOption 和 system.multicall, 任务按 --rate 推进进度,
+第 n 个任务的大小是 --size 的 n 倍, 依次完成; 完成时通过 WebSocket 推送 aria2.onDownloadComplete。每条通知分两次发送, 中间停顿 --split-delay 秒;
+停顿超过 Aria2Monitor 的读取超时(1 秒)时, 覆盖读取超时落在一帧中间的情况:
+    python ./ComfyUI/DownloadManager/utils/fake_aria2.py --files 3 --size 16 --rate 8 --split-delay 1.5
+
+脚本提交任务后用 Aria2Monitor 跟踪到全部完成, 输出每个任务从完成到被发现的延迟、tellStatus 调用次数,
+以及监视器实际解析出的通知条数(通知连接断开后只能靠轮询发现完成)。
+"""
+import os
+import sys
+import json
+import time
+import base64
+import hashlib
+import argparse
+import itertools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+sys.path.append(os.getcwd())
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+TICK = 0.05  # 推进下载进度的间隔(秒)
+
+
+class FakeAria2:
+    """模拟的 aria2 任务表, 所有方法都在锁内执行"""
+
+    def __init__(self, size, rate, split_delay=0):
+        self.size = size  # 第一个任务的大小
+        self.rate = rate
+        self.split_delay = split_delay
+        self.tasks = {}  # gid -> aria2 格式的状态(数值字段为字符串)
+        self.options = {}  # gid -> 提交时和之后修改的选项
+        self.global_options = {}
+        self.completed_at = {}  # gid -> 完成时间
+        self.calls = {}  # 方法名 -> 调用次数
+        self.sockets = []  # 已升级为 WebSocket 的连接
+        self.pushed = 0
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def call(self, method, params):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if params and isinstance(params[0], str) and params[0].startswith("token:"):
+            params = params[1:]
+        if method == "system.multicall":
+            results = []
+            for call in params[0]:
+                try:
+                    results.append([self.call(call["methodName"], call["params"])])
+                except (KeyError, ValueError) as e:
+                    results.append({"code": 1, "message": str(e)})
+            return results
+        if method == "aria2.addUri":
+            index = next(self.counter)
+            gid = f"{index:016x}"
+            self.tasks[gid] = {
+                "gid": gid, "status": "active", "totalLength": str(self.size * index), "completedLength": "0",
+                "downloadSpeed": str(int(self.rate)), "errorMessage": "",
+            }
+            self.options[gid] = dict(params[1]) if len(params) > 1 else {}
+            return gid
+        if method == "aria2.changeOption":
+            self.options[params[0]].update(params[1])
+            return "OK"
+        if method == "aria2.changeGlobalOption":
+            self.global_options.update(params[0])
+            return "OK"
+        if method == "aria2.tellStatus":
+            status = self.tasks[params[0]]
+            keys = params[1] if len(params) > 1 else status.keys()
+            return {key: status[key] for key in keys if key in status}
+        if method in ("aria2.pause", "aria2.unpause", "aria2.remove"):
+            status = self.tasks[params[0]]
+            status["status"] = {"aria2.pause": "paused", "aria2.unpause": "active", "aria2.remove": "removed"}[method]
+            status["downloadSpeed"] = str(int(self.rate)) if status["status"] == "active" else "0"
+            return params[0]
+        raise ValueError(f"Method not found: {method}")
+
+    def tick(self, elapsed):
+        """推进所有进行中的任务, 返回刚完成的 GID"""
+        finished = []
+        for gid, status in self.tasks.items():
+            if status["status"] != "active":
+                continue
+            total = int(status["totalLength"])
+            completed = min(total, int(status["completedLength"]) + int(self.rate * elapsed))
+            status["completedLength"] = str(completed)
+            if completed >= total:
+                status["status"] = "complete"
+                status["downloadSpeed"] = "0"
+                self.completed_at[gid] = time.time()
+                finished.append(gid)
+        return finished
+
+    def run(self, stopped):
+        last = time.time()
+        while not stopped.wait(TICK):
+            now = time.time()
+            with self.lock:
+                finished = self.tick(now - last)
+            last = now
+            for gid in finished:
+                self.notify("aria2.onDownloadComplete", gid)
+
+    def notify(self, method, gid):
+        data = json.dumps({"jsonrpc": "2.0", "method": method, "params": [{"gid": gid}]}).encode()
+        if len(data) < 126:
+            frame = bytes([0x81, len(data)]) + data
+        else:
+            frame = bytes([0x81, 126]) + len(data).to_bytes(2, "big") + data
+        with self.lock:
+            sockets = list(self.sockets)
+            self.pushed += 1
+        # 先只发帧头和一小部分负载, 停顿后再发剩下的
+        for i, part in enumerate((frame[:4], frame[4:])):
+            if i and self.split_delay:
+                time.sleep(self.split_delay)
+            for sock in sockets:
+                try:
+                    sock.sendall(part)
+                except OSError:
+                    pass
+
+
+class FakeAria2Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    aria2 = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        try:
+            with self.aria2.lock:
+                response["result"] = self.aria2.call(request["method"], request.get("params", []))
+        except (KeyError, ValueError) as e:
+            response["error"] = {"code": 1, "message": str(e)}
+        data = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        # WebSocket 握手, 之后只推送通知; 客户端发来的帧(pong、close)直接丢弃
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+        with self.aria2.lock:
+            self.aria2.sockets.append(self.connection)
+        try:
+            while self.connection.recv(4096):
+                pass
+        except OSError:
+            pass
+        with self.aria2.lock:
+            self.aria2.sockets.remove(self.connection)
+        self.close_connection = True
+
+
+def serve(aria2, port):
+    """在后台线程里启动服务器和进度推进线程, 返回停止它们的函数"""
+    handler = type("Handler", (FakeAria2Handler,), {"aria2": aria2})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    stopped = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=aria2.run, args=(stopped,), daemon=True).start()
+
+    def stop():
+        stopped.set()
+        server.shutdown()
+        server.server_close()
+
+    return stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Track downloads on a local fake aria2 with Aria2Monitor")
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--size", type=float, default=64, help="file size in MiB")
+    parser.add_argument("--rate", type=float, default=16, help="MB/s of each task")
+    parser.add_argument("--split-delay", type=float, default=0, help="seconds between the two halves of each notification")
+    parser.add_argument("--port", type=int, default=16801)
+    args = parser.parse_args()
+
+    from PySide6.QtCore import Qt
+    from ComfyUI.DownloadManager.common import aria2 as aria2_module
+    from ComfyUI.DownloadManager.common.aria2 import Aria2Client, Aria2Monitor
+
+    received = []
+
+    class CountingNotifications(aria2_module.Aria2Notifications):
+        # 统计监视器真正解析出的通知, 区分"靠通知发现完成"和"靠轮询发现完成"
+        def receive(self):
+            message = super().receive()
+            if message is not None:
+                received.append(message)
+            return message
+
+    aria2_module.Aria2Notifications = CountingNotifications
+
+    aria2 = FakeAria2(int(args.size * 1024 * 1024), args.rate * 1024 * 1024, args.split_delay)
+    stop = serve(aria2, args.port)
+    try:
+        client = Aria2Client(f"http://127.0.0.1:{args.port}/jsonrpc", "secret")
+        gids = client.add_uris([(f"http://example.com/model{i}.bin", {}) for i in range(args.files)])
+        monitor = Aria2Monitor(gids, client)
+        detected = {}
+        progress = []
+        monitor.download_complete.connect(lambda gid: detected.setdefault(gid, time.time()), Qt.DirectConnection)
+        monitor.update_progress.connect(progress.append, Qt.DirectConnection)
+        start = time.time()
+        monitor.run()
+        wall = time.time() - start
+    finally:
+        stop()
+
+    latencies = [detected[gid] - aria2.completed_at[gid] for gid in gids if gid in detected]
+    print(f"{len(detected)}/{len(gids)} tasks completed in {wall:.1f} s, {len(progress)} progress updates")
+    if latencies:
+        print(f"completion detected after {sum(latencies) / len(latencies) * 1000:.0f} ms on average, "
+              f"{max(latencies) * 1000:.0f} ms at most")
+    print(f"{aria2.calls.get('aria2.tellStatus', 0)} tellStatus calls in "
+          f"{aria2.calls.get('system.multicall', 0) - 1} multicalls, {aria2.pushed} notifications pushed")
+    # 监视器在最后一个任务完成后就退出, 最后一条通知可能还没读到
+    print(f"{len(received)} notifications received by Aria2Monitor")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ from qfluentwidgets import ToolButton, BodyLabel, FluentIcon as FIF
 
 class TagWidget(QWidget):
     deleteSignal = Signal(str)
+    raiseSignal = Signal(str)
 
     def __init__(self, text: str, parent=None):
         super().__init__(parent)
@@ -19,6 +20,15 @@ class TagWidget(QWidget):
         # text_label.setFont(QFont("Consolas", 12))
         layout.addWidget(self.text_label)
 
+        self.raise_button = ToolButton(FIF.UP)
+        self.raise_button.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
+        self.raise_button.setFixedSize(20, 20)
+        self.raise_button.setStyleSheet("background-color: transparent")
+        self.raise_button.setToolTip(self.tr("Download first"))
+
+        self.raise_button.clicked.connect(self.onRaiseClicked)
+        layout.addWidget(self.raise_button)
+
         self.delete_button = ToolButton(FIF.UNPIN)
         self.delete_button.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
         self.delete_button.setFixedSize(20, 20)
@@ -34,5 +44,8 @@ class TagWidget(QWidget):
         #     padding: 5px 10px;
         # """)
 
+    def onRaiseClicked(self):
+        self.raiseSignal.emit(self.text)
+
     def onDeleteClicked(self):
         self.deleteSignal.emit(self.text)
\ No newline at end of file